@@ -0,0 +1,142 @@
+import os
+from json import load
+from multiprocessing import Pool
+from sys import maxsize
+
+
+class EmptyHtmlStats:
+
+    def __init__(self):
+        self.empty, self.total_html, self.total_configs, self.only_empty_html = 0, 0, 0, 0
+
+    def visit(self, content):
+        self.total_configs += 1
+        only_empty = True
+        for sub_conf in content.values():
+            for trusted_type in sub_conf:
+                if trusted_type == 'TrustedHTML':
+                    self.total_html += 1
+                    for val in sub_conf['TrustedHTML']['scripts'].values():
+                        if val:
+                            only_empty = False
+                            break
+                    else:
+                        self.empty += 1
+                else:
+                    only_empty = False
+        if only_empty:
+            self.only_empty_html += 1
+
+    def merge(self, other):
+        self.empty += other.empty
+        self.total_html += other.total_html
+        self.total_configs += other.total_configs
+        self.only_empty_html += other.only_empty_html
+
+    def render(self):
+        print(f"Total amount of configs: {self.total_configs}")
+        print(f"Total amount of HTML writing parties: {self.total_html}")
+        print(f"Total amount of empty HTML policies: {self.empty}")
+        print(f"Percentage of empty HTML policies: {round(self.empty / self.total_html * 100, 2)}%")
+        print(f"Number of configs containing only empty HTML policies: {self.only_empty_html}")
+        print('\n')
+
+
+class AllowlistLengthStats:
+
+    def __init__(self):
+        self.allowlisted, self.min, self.max, self.count, self.count_one = set(), maxsize, 0, 0, 0
+
+    def _add(self, allowlist):
+        res = len(allowlist)
+        self.count += 1
+        self.min = min(self.min, res)
+        self.max = max(self.max, res)
+        if res == 1:
+            self.count_one += 1
+        self.allowlisted.update(allowlist)
+
+    def visit(self, content):
+        for sub_conf in content.values():
+            for val in sub_conf.values():
+                for directive in val:
+                    if directive == 'scripts':
+                        for l in val['scripts'].values():
+                            if len(l) > 0:
+                                self._add(l)
+                    elif isinstance(val[directive], list) and len(val[directive]) > 0:
+                        self._add(val[directive])
+
+    def merge(self, other):
+        self.allowlisted |= other.allowlisted
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.count_one += other.count_one
+
+    def render(self):
+        print(f"Total number of non-empty allowlists: {self.count}")
+        print(f"Total number of allowlisted values: {len(self.allowlisted)}")
+        print(f"Minimum length of allowlist: {self.min}")
+        print(f"Maximum length of allowlist: {self.max}")
+        print(f"Average length of allowlist: {round(len(self.allowlisted) / self.count)}")
+        print(f"Number of allowlists that contain only one element: {self.count_one}")
+        temp1, temp2 = len(self.allowlisted) - self.count_one, self.count - self.count_one
+        print(f"Average length of non-length one allowlists: {round(temp1 / temp2)}")
+        print('\n')
+
+
+class AllowAnyStats:
+
+    def __init__(self):
+        self.total, self.flag_set, self.parties, self.total_parties = 0, 0, set(), set()
+
+    def visit(self, content):
+        for party, sub_conf in content.items():
+            self.total_parties.add(party)
+            for val in sub_conf.values():
+                for directive in val:
+                    if directive == 'allow-any':
+                        self.parties.add(party)
+                        self.flag_set += 1
+            self.total += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.flag_set += other.flag_set
+        self.parties |= other.parties
+        self.total_parties |= other.total_parties
+
+    def render(self):
+        print(f"Total number of sub policies: {self.total}")
+        print(f"Number of sub policies with allow-any: {self.flag_set}")
+        print(f"Percentage: {round(self.flag_set / self.total * 100, 2)}%")
+        print(f"Amount of parties with allow-any set: {len(self.parties)}/{len(self.total_parties)}")
+        print('\n')
+
+
+def _visit_files(dir, files, stats_classes):
+    stats = [stats_class() for stats_class in stats_classes]
+    for file in files:
+        with open(os.path.join(dir, file)) as f:
+            content = load(f)
+        del content['ignoreList']
+        for stat in stats:
+            stat.visit(content)
+    return stats
+
+
+def analyze_configs(dir, stats_classes, processes=1):
+    # every config is parsed exactly once and handed to all registered statistics
+    # only the JSON configs, --compact writes its binary files into the same directory
+    files = sorted(file for file in os.listdir(dir) if file.endswith('_config.json'))
+    if processes == 1 or len(files) < 2:
+        return _visit_files(dir, files, stats_classes)
+    chunks = [files[i::processes] for i in range(processes)]
+    with Pool(processes) as pool:
+        partials = pool.starmap(_visit_files, ((dir, chunk, stats_classes) for chunk in chunks if chunk))
+    stats = partials[0]
+    for partial in partials[1:]:
+        for stat, other in zip(stats, partial):
+            stat.merge(other)
+    return stats
@@ -0,0 +1,134 @@
+import argparse
+import os
+import sys
+from collections import Counter
+from multiprocessing import Pool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'generators'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'testapp'))
+from config_generator import positive_int
+from db import CREDENTIALS_PATH, close_databases, get_database
+from input_store import open_input_store
+from testapp.enforcement import PolicyCache
+
+# one line per evaluated database is appended, like functionality_evaluator.js does
+RESULTS_PATH = '/data/scripts/results.txt'
+# rows fetched from the server-side cursor at once, their inputs are read in one batch
+ITERSIZE = 2000
+TRUSTED_TYPES = ['TrustedScriptURL', 'TrustedScript', 'TrustedHTML']
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Replay the inputs of crawl databases against generated configs')
+    parser.add_argument('-c', '--credentials', default=CREDENTIALS_PATH,
+                        help='Path to the JSON file holding the credentials of the database')
+    parser.add_argument('-db', '--databases', nargs='+', default=None,
+                        help='Databases to evaluate one after the other, defaults to the one in the credentials')
+    parser.add_argument('-d', '--directory', default='/data/configs',
+                        help='Directory containing the generated *_config.json files')
+    parser.add_argument('-i', '--inputs', default='/data/inputs',
+                        help='Sharded input directory or packed store created by input_store.py')
+    parser.add_argument('-p', '--processes', default=os.cpu_count(), type=positive_int,
+                        help='Number of worker processes origins are spread across, 1 runs everything in the main process')
+    parser.add_argument('-r', '--results', default=RESULTS_PATH,
+                        help='File the total of every evaluated database is appended to')
+    parser.add_argument('--enforcement', action='store_true',
+                        help='Check TrustedHTML inputs as strictly as the testapp enforces them, by default they are '
+                             'accepted like library_node.js does, so the totals compare to functionality_results.txt')
+    return vars(parser.parse_args())
+
+
+def evaluate_origin(origin, db, store, policies):
+    # counts of an origin, None if there is no config for it
+    config = policies.get(origin)
+    if config is None:
+        return None
+    counts = Counter()
+    with db.connection() as conn, conn.cursor(name='tt_data_origin_inputs') as cursor:
+        cursor.itersize = ITERSIZE
+        cursor.execute("SELECT DISTINCT input_hash, trusted_type, party_origin FROM tt_data WHERE origin=%s;",
+                       (origin,))
+        while rows := cursor.fetchmany(ITERSIZE):
+            # these exhibit strange behavior, so ignore them like the JS evaluator
+            rows = [row for row in rows if row[2] is not None]
+            contents = dict(store.get_many({input_hash for input_hash, _, _ in rows}))
+            for input_hash, trusted_type, party_origin in rows:
+                counts['inputs'] += 1
+                policy = config.policy(party_origin, trusted_type)
+                if policy is None:
+                    counts['new policies'] += 1
+                elif policy.sanitize(contents[input_hash], origin) == contents[input_hash]:
+                    counts['non-changed'] += 1
+                else:
+                    counts[trusted_type] += 1
+    return counts
+
+
+# state of the current (worker) process, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(args, database):
+    _worker.update({'db': get_database(args['credentials'], database), 'store': open_input_store(args['inputs']),
+                    'policies': PolicyCache(args['directory'], js_compatible=not args['enforcement'])})
+
+
+def _evaluate_in_worker(origin):
+    return origin, evaluate_origin(origin, _worker['db'], _worker['store'], _worker['policies'])
+
+
+def _close_worker():
+    if 'store' in _worker:
+        _worker.pop('store').close()
+
+
+def _collect(results):
+    totals, origin_count, missing = Counter(), 0, 0
+    for origin, counts in results:
+        origin_count += 1
+        if counts is None:
+            missing += 1
+            print(f"No config found for origin {origin}, skipping this origin", file=sys.stderr)
+            continue
+        totals.update(counts)
+        print(f"Non-changed inputs for origin {origin} : {counts['non-changed']}/{counts['inputs']}")
+    return totals, origin_count, missing
+
+
+def evaluate_database(args, database=None):
+    db = get_database(args['credentials'], database)
+    origins = (origin for origin, in db.stream("SELECT DISTINCT origin FROM tt_data;"))
+    try:
+        if args['processes'] == 1:
+            _init_worker(args, database)
+            try:
+                totals, origin_count, missing = _collect(map(_evaluate_in_worker, origins))
+            finally:
+                _close_worker()
+        else:
+            with Pool(args['processes'], initializer=_init_worker, initargs=(args, database)) as pool:
+                # imap keeps the order of the origins, so the output is the same for any number of processes
+                totals, origin_count, missing = _collect(pool.imap(_evaluate_in_worker, origins, chunksize=4))
+    finally:
+        close_databases()
+
+    print(f"\nTotal of non-changed inputs: {totals['non-changed']}/{totals['inputs']}")
+    for trusted_type in TRUSTED_TYPES:
+        print(f"Total of newly encountered {trusted_type} uses: {totals[trusted_type]}")
+    print(f"Total of new parties or new TrustedTypes used by existing parties: {totals['new policies']}")
+    print(f"Amount of origins for which no config was found: {missing}/{origin_count}")
+    with open(args['results'], 'a') as file:
+        file.write(f"{totals['non-changed']}/{totals['inputs']}\n")
+    return totals
+
+
+def main():
+    args = get_args()
+    for database in args['databases'] or [None]:
+        if args['databases'] is not None:
+            print(f"\n{database}")
+        evaluate_database(args, database)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import json
+import os
+
+import numpy as np
+
+from html_extract import extract_elements
+
+TRUSTED_TYPES = ['TrustedHTML', 'TrustedScript', 'TrustedScriptURL']
+# URL classes in the order analyze_urls checks them
+URL_CLASSES = ['https', 'http', 'blob', 'data', 'protocol-relative', 'local', 'other']
+# url_class of inputs that aren't TrustedScriptURLs
+NO_URL = 255
+
+# column name -> dtype, one row per (input_hash, trusted_type)
+COLUMNS = {
+    'input_hash': 'S64',
+    'trusted_type': np.uint8,
+    'length': np.int64,
+    'url_class': np.uint8,
+    'blob_http': np.bool_,
+    'json_parsable': np.bool_,
+    'data_frames': np.int32,
+    'tokenizable': np.bool_,
+}
+
+
+def _url_class(content):
+    if content.startswith('https'):
+        return URL_CLASSES.index('https')
+    elif content.startswith('http'):
+        return URL_CLASSES.index('http')
+    elif content.startswith('blob:'):
+        return URL_CLASSES.index('blob')
+    elif content.startswith('data:'):
+        return URL_CLASSES.index('data')
+    elif content.startswith('//'):
+        return URL_CLASSES.index('protocol-relative')
+    elif content.startswith('/') or content.startswith('.') or content.startswith('js'):
+        return URL_CLASSES.index('local')
+    return URL_CLASSES.index('other')
+
+
+def _json_parsable(content):
+    try:
+        json.loads(content[1:-1])
+        return True
+    except:
+        return False
+
+
+def _count_data_frames(content):
+    count = 0
+    for tag in extract_elements(content):
+        if tag.name == 'iframe' and tag.get('src', '').startswith('data:'):
+            count += 1
+    return count
+
+
+def compute_features(input_hash, trusted_type, content, token_cache):
+    is_url, is_script = trusted_type == 'TrustedScriptURL', trusted_type == 'TrustedScript'
+    return {
+        'input_hash': input_hash,
+        'trusted_type': TRUSTED_TYPES.index(trusted_type),
+        'length': len(content),
+        'url_class': _url_class(content) if is_url else NO_URL,
+        'blob_http': is_url and content.startswith('blob:') and content[5:].startswith('http'),
+        'json_parsable': is_script and _json_parsable(content),
+        'data_frames': _count_data_frames(content) if trusted_type == 'TrustedHTML' else 0,
+        # input hashes double as keys of the token cache shared with the generators
+        'tokenizable': is_script and token_cache.token_hash(content, input_hash) is not None,
+    }
+
+
+def load_features(path):
+    if not os.path.exists(path):
+        return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+    with np.load(path) as data:
+        return {name: data[name] for name in COLUMNS}
+
+
+def save_features(path, features):
+    # written to a temporary file first, so that a crash never leaves a half-written table behind
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **features)
+    os.replace(tmp_path, path)
+
+
+def select(features, hashes, trusted_type):
+    # rows of the given Trusted Type whose input hash is one of hashes
+    return (features['trusted_type'] == TRUSTED_TYPES.index(trusted_type)) & np.isin(features['input_hash'], hashes)
+
+
+def ensure_features(path, hashes, trusted_type, input_store, token_cache):
+    # only inputs that are not in the table yet are read and classified
+    features = load_features(path)
+    hashes = np.unique(np.asarray(hashes, dtype='S64'))
+    new_hashes = hashes[~np.isin(hashes, features['input_hash'][select(features, hashes, trusted_type)])]
+    if len(new_hashes) == 0:
+        return features
+    rows = [compute_features(input_hash, trusted_type, content, token_cache)
+            for input_hash, content in input_store.get_many(h.decode() for h in new_hashes)]
+    for name, dtype in COLUMNS.items():
+        features[name] = np.concatenate([features[name], np.array([row[name] for row in rows], dtype=dtype)])
+    token_cache.flush()
+    save_features(path, features)
+    return features
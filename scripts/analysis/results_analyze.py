@@ -1,84 +1,39 @@
-import json
 import os
-from json import load
-from sys import maxsize
+import sys
 
-import psycopg2
-from bs4 import BeautifulSoup
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'generators'))
+from config_analysis import AllowAnyStats, AllowlistLengthStats, EmptyHtmlStats, analyze_configs
+from db import get_database
+from input_features import URL_CLASSES, ensure_features, select
+from input_store import open_input_store
+from token_cache import load_token_cache
+
+# either the sharded input directory or a packed store created by input_store.py
+INPUT_STORE = '/data/inputs'
+# per-input feature table, extended with every input the analysis functions haven't seen yet
+FEATURES_PATH = '/data/input_features.npz'
+# token cache shared with the generators
+TOKEN_CACHE = '/data/token_cache.sqlite'
+CREDENTIALS_PATH = '/data/credentials.json'
+# crawl analyzed by default and the one after it, compared by compare_origins
+DATABASE = 'trustedtypes_20210213'
+NEXT_DATABASE = 'trustedtypes_20210214'
 
 
 def search_empty_html(dir):
-    empty, total_html, total_configs, only_empty_html = 0, 0, 0, 0
-    for file in os.listdir(dir):
-        total_configs += 1
-        with open(os.path.join(dir, file)) as f:
-            content = load(f)
-            del content['ignoreList']
-            only_empty = True
-            for sub_conf in content.values():
-                for trusted_type in sub_conf:
-                    if trusted_type == 'TrustedHTML':
-                        total_html += 1
-                        for val in sub_conf['TrustedHTML']['scripts'].values():
-                            if val:
-                                only_empty = False
-                                break
-                        else:
-                            empty += 1
-                    else:
-                        only_empty = False
-            if only_empty:
-                only_empty_html += 1
-    print(f"Total amount of configs: {total_configs}")
-    print(f"Total amount of HTML writing parties: {total_html}")
-    print(f"Total amount of empty HTML policies: {empty}")
-    print(f"Percentage of empty HTML policies: {round(empty / total_html * 100, 2)}%")
-    print(f"Number of configs containing only empty HTML policies: {only_empty_html}")
-    print('\n')
+    analyze_configs(dir, [EmptyHtmlStats])[0].render()
 
 
 def collect_allowlist_lengths(dir):
-    allowlisted, min, max, count, count_one = set(), maxsize, 0, 0, 0
-    for file in os.listdir(dir):
-        with open(os.path.join(dir, file)) as f:
-            content = load(f)
-            del content['ignoreList']
-            for sub_conf in content.values():
-                for val in sub_conf.values():
-                    for directive in val:
-                        if directive == 'scripts':
-                            for l in val['scripts'].values():
-                                res = len(l)
-                                if res > 0:
-                                    count += 1
-                                    if res < min:
-                                        min = res
-                                    if res > max:
-                                        max = res
-                                    if res == 1:
-                                        count_one += 1
-                                    for elem in l:
-                                        allowlisted.add(elem)
-                        elif isinstance(val[directive], list) and len(val[directive]) > 0:
-                            res = len(val[directive])
-                            count += 1
-                            if res < min:
-                                min = res
-                            if res > max:
-                                max = res
-                            if res == 1:
-                                count_one += 1
-                            for elem in val[directive]:
-                                allowlisted.add(elem)
-    print(f"Total number of non-empty allowlists: {count}")
-    print(f"Total number of allowlisted values: {len(allowlisted)}")
-    print(f"Minimum length of allowlist: {min}")
-    print(f"Maximum length of allowlist: {max}")
-    print(f"Average length of allowlist: {round(len(allowlisted) / count)}")
-    print(f"Number of allowlists that contain only one element: {count_one}")
-    temp1, temp2 = len(allowlisted) - count_one, count - count_one
-    print(f"Average length of non-length one allowlists: {round(temp1 / temp2)}")
-    print('\n')
+    analyze_configs(dir, [AllowlistLengthStats])[0].render()
+
+
+def report_configs(dir, processes=1):
+    # all config statistics from a single pass over the config directory
+    for stats in analyze_configs(dir, [EmptyHtmlStats, AllowlistLengthStats, AllowAnyStats], processes):
+        stats.render()
 
 
 def collect_clustering_stats(dir):
@@ -96,20 +51,20 @@ def collect_clustering_stats(dir):
     print('\n')
 
 
+def _input_features(db, trusted_type):
+    # feature rows of all distinct inputs of the given type, classifying only inputs not seen before
+    hashes = np.array([val for val, in db.stream("Select distinct input_hash from tt_data where trusted_type=%s",
+                                                  (trusted_type,))], dtype='S64')
+    store = open_input_store(INPUT_STORE)
+    features = ensure_features(FEATURES_PATH, hashes, trusted_type, store, load_token_cache(TOKEN_CACHE))
+    store.close()
+    mask = select(features, hashes, trusted_type)
+    return {name: column[mask] for name, column in features.items()}
+
+
 def find_json_parsable():
-    total, parsable, parties = 0, 0, set()
-    conn = psycopg2.connect(host="127.0.0.1", user="daniel", database="trustedtypes_20210213", password='butitwasmedio')
-    cur = conn.cursor()
-    cur.execute("Select distinct input_hash from tt_data where trusted_type='TrustedScript'")
-    for val, in cur.fetchall():
-        with open(f"/data/inputs/{val[0:2]}/{val}.txt") as file:
-            content = file.read()
-            total += 1
-            try:
-                json.loads(content[1:-1])
-                parsable += 1
-            except:
-                continue
+    features = _input_features(get_database(CREDENTIALS_PATH, DATABASE), 'TrustedScript')
+    total, parsable = len(features['input_hash']), int(features['json_parsable'].sum())
 
     print(f"Total considered inputs: {total}")
     print(f"JSON parsable inputs: {parsable}")
@@ -119,36 +74,21 @@ def find_json_parsable():
 
 
 def analyze_urls():
-    total, https_urls, http_urls, blob_urls, blob_http_urls, data_urls, protocol_relative, local = 0, 0, 0, 0, 0, 0, 0, 0
-    conn = psycopg2.connect(host="127.0.0.1", user="daniel", database="trustedtypes_20210213", password='butitwasmedio')
-    cur = conn.cursor()
-    cur.execute("Select distinct input_hash from tt_data where trusted_type='TrustedScriptURL'")
-    for val, in cur.fetchall():
-        with open(f"/data/inputs/{val[0:2]}/{val}.txt") as file:
-            content = file.read()
-            total += 1
-            if content.startswith('https'):
-                https_urls += 1
-            elif content.startswith('http'):
-                http_urls += 1
-            elif content.startswith('blob:'):
-                blob_urls += 1
-                if (content[5:]).startswith('http'):
-                    blob_http_urls += 1
-            elif content.startswith('data:'):
-                data_urls += 1
-            elif content.startswith('//'):
-                protocol_relative += 1
-            elif content.startswith('/') or content.startswith('.') or content.startswith('js'):
-                local += 1
-            else:
-                print(content)
-
-    print(f"Total number of url inputs: {total}")
+    features = _input_features(get_database(CREDENTIALS_PATH, DATABASE), 'TrustedScriptURL')
+    counts = np.bincount(features['url_class'], minlength=len(URL_CLASSES))
+    https_urls, http_urls, blob_urls, data_urls, protocol_relative, local, other = (int(count) for count in counts)
+    # unclassified URLs are the only ones that still have to be read
+    store = open_input_store(INPUT_STORE)
+    other_hashes = features['input_hash'][features['url_class'] == URL_CLASSES.index('other')]
+    for val, content in store.get_many(h.decode() for h in other_hashes):
+        print(content)
+    store.close()
+
+    print(f"Total number of url inputs: {len(features['input_hash'])}")
     print(f"HTTPS urls: {https_urls}")
     print(f"HTTP urls: {http_urls}")
     print(f"blob urls: {blob_urls}")
-    print(f"blob urls with http after it: {blob_http_urls}")
+    print(f"blob urls with http after it: {int(features['blob_http'].sum())}")
     print(f"data urls: {data_urls}")
     print(f"protocol-relative urls: {protocol_relative}")
     print(f"local urls: {local}")
@@ -156,22 +96,7 @@ def analyze_urls():
 
 
 def search_data_frames():
-    count = 0
-    conn = psycopg2.connect(host="127.0.0.1", user="daniel", database="trustedtypes_20210213", password='butitwasmedio')
-    cur = conn.cursor()
-    cur.execute("Select distinct input_hash from tt_data where trusted_type='TrustedHTML'")
-    for val, in cur.fetchall():
-        with open(f"/data/inputs/{val[0:2]}/{val}.txt") as file:
-            content = file.read()
-            parsed = BeautifulSoup(content, "html.parser")
-
-            for tag in parsed.find_all(True):
-                if tag.name == 'iframe':
-                    try:
-                        if tag['src'].startswith('data:'):
-                            count += 1
-                    except KeyError:
-                        continue
+    count = int(_input_features(get_database(CREDENTIALS_PATH, DATABASE), 'TrustedHTML')['data_frames'].sum())
     if count == 0:
         print('No data: URL iframes found')
     else:
@@ -180,50 +105,23 @@ def search_data_frames():
 
 
 def allow_any_search(dir):
-    total, flag_set, parties, total_parties = 0, 0, set(), set()
-    for file in os.listdir(dir):
-        with open(os.path.join(dir, file)) as f:
-            content = load(f)
-            del content['ignoreList']
-            for party, sub_conf in content.items():
-                total_parties.add(party)
-                for val in sub_conf.values():
-                    for directive in val:
-                        if directive == 'allow-any':
-                            parties.add(party)
-                            flag_set += 1
-                total += 1
-    print(f"Total number of sub policies: {total}")
-    print(f"Number of sub policies with allow-any: {flag_set}")
-    print(f"Percentage: {round(flag_set / total * 100, 2)}%")
-    print(f"Amount of parties with allow-any set: {len(parties)}/{len(total_parties)}")
-    print('\n')
+    analyze_configs(dir, [AllowAnyStats])[0].render()
 
 
 def compare_origins():
-    conn1 = psycopg2.connect(host="127.0.0.1", user="daniel", database="trustedtypes_20210213",
-                             password='butitwasmedio')
-    cur1 = conn1.cursor()
-    conn2 = psycopg2.connect(host="127.0.0.1", user="daniel", database="trustedtypes_20210214",
-                             password='butitwasmedio')
-    cur2 = conn2.cursor()
     query = 'select distinct origin from tt_data;'
-    cur1.execute(query)
-    cur2.execute(query)
-    origins1 = set(x[0] for x in cur1.fetchall())
-    origins2 = set(x[0] for x in cur2.fetchall())
+    origins1 = set(x[0] for x in get_database(CREDENTIALS_PATH, DATABASE).stream(query))
+    origins2 = set(x[0] for x in get_database(CREDENTIALS_PATH, NEXT_DATABASE).stream(query))
     print(f"Origins in one of the dbs but not the other: {(origins1 - origins2) | (origins2 - origins1)}")
     print('\n')
 
 
 def get_distinct_js_count():
-    conn = psycopg2.connect(host="127.0.0.1", user="daniel", database="trustedtypes_20210213", password='butitwasmedio')
-    cur = conn.cursor()
-    cur.execute("select distinct input_hash from tt_data where trusted_type='TrustedScript';")
-    val1 = set(x[0] for x in cur.fetchall())
-    cur.execute("select distinct input_hash from tt_dangerous_html;")
-    val2 = set(x[0] for x in cur.fetchall())
-    print(len(val1 | val2))
+    db = get_database(CREDENTIALS_PATH, DATABASE)
+    query = "select distinct input_hash from tt_data where trusted_type='TrustedScript';"
+    val1 = np.array([x[0] for x in db.stream(query)], dtype='S64')
+    val2 = np.array([x[0] for x in db.stream("select distinct input_hash from tt_dangerous_html;")], dtype='S64')
+    print(len(np.union1d(val1, val2)))
 
 
 def analyze_sites_and_parties():
@@ -258,6 +156,7 @@ def main():
     config_dir = '/data/configs/'
     # search_empty_html(config_dir)
     # collect_allowlist_lengths(config_dir)
+    # report_configs(config_dir, processes=os.cpu_count())
     # collect_clustering_stats('/data/outputs/')
     # find_json_parsable()
     # analyze_urls()
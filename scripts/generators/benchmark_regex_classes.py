@@ -0,0 +1,71 @@
+import argparse
+import random
+import string
+from re import search, escape
+from time import perf_counter
+
+from regex_classes import REGEX_CLASSES, get_regex_for_tuple
+
+# character pools matching each of REGEX_CLASSES, so that every class gets picked in the synthetic clusters
+POOLS = [string.ascii_lowercase, string.ascii_lowercase + string.digits, string.ascii_letters + string.digits,
+         string.ascii_letters + string.digits + '"_;-', string.printable.strip() + 'äß€😀']
+
+
+def _reference_get_regex_for_tuple(values):
+    # the implementation before the single-pass class selection
+    if all(val == values[0] for val in values):
+        return escape(values[0])
+    else:
+        min_val, max_val = len(min(values, key=lambda x: len(x))), len(max(values, key=lambda x: len(x)))
+        for res in REGEX_CLASSES:
+            if min_val == max_val:
+                res += '{%d}' % min_val
+            else:
+                res += '{%d,%d}' % (min_val, max_val)
+
+            if all(search(f"^{res}$", inp) is not None for inp in values):
+                return res
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', nargs='*', type=int, default=[10, 100, 1000, 5000],
+                        help='Number of members of the synthetic clusters')
+    parser.add_argument('-t', '--tokens', default=200, type=int,
+                        help='Number of tokens per cluster member')
+    parser.add_argument('--seed', default=0, type=int)
+    return vars(parser.parse_args())
+
+
+def _synthetic_columns(size, tokens):
+    columns = []
+    for _ in range(tokens):
+        kind = random.random()
+        if kind < 0.3:
+            # keywords and punctuators are the same in every member
+            value = random.choice(['var', '=', ';', '(', ')', 'function', '{', '}', '.', ','])
+            columns.append([value] * size)
+        else:
+            pool = random.choice(POOLS)
+            columns.append([''.join(random.choices(pool, k=random.randint(1, 20))) for _ in range(size)])
+    return columns
+
+
+def main():
+    args = get_args()
+    random.seed(args['seed'])
+    for size in args['sizes']:
+        columns = _synthetic_columns(size, args['tokens'])
+        start = perf_counter()
+        before = [_reference_get_regex_for_tuple(values) for values in columns]
+        reference_time = perf_counter() - start
+        start = perf_counter()
+        after = [get_regex_for_tuple(values) for values in columns]
+        new_time = perf_counter() - start
+        assert before == after, 'single-pass class selection changed the generated regex'
+        print(f"{size} members x {args['tokens']} tokens: {reference_time:.3f}s before, {new_time:.3f}s after "
+              f"({reference_time / new_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
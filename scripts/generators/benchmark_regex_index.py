@@ -0,0 +1,87 @@
+import argparse
+import json
+import random
+from time import perf_counter
+
+import config_generator
+from db import get_database
+from input_store import open_input_store
+from regex_index import RegexIndex
+from token_cache import TokenCache
+
+
+class _JsonReloadIndex:
+    # behaves like the generator did before the index: re-parse the whole file for every lookup
+
+    def __init__(self, regex_path):
+        self.regex_path = regex_path
+
+    def get(self, cluster):
+        with open(self.regex_path) as file:
+            return json.load(file).get(cluster)
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--regexes', default='/data/outputs/regexes.json',
+                        help='Path to JSON file containing regexes used in the generation')
+    parser.add_argument('-c', '--credentials', default='/data/credentials.json',
+                        help='Path to JSON file containing the basic database credentials')
+    parser.add_argument('-i', '--inputs', default='/data/inputs',
+                        help='Path to the input store used for the full origin run')
+    parser.add_argument('-o', '--origin', default=None,
+                        help='Origin to generate a full config for, only lookups are measured if omitted')
+    parser.add_argument('-n', '--lookups', default=100, type=config_generator.positive_int,
+                        help='Number of cluster lookups to measure if no origin is given')
+    return vars(parser.parse_args())
+
+
+def _time_lookups(index, clusters):
+    start = perf_counter()
+    for cluster in clusters:
+        index.get(cluster)
+    return perf_counter() - start
+
+
+def _time_origin(index, args):
+    db = get_database(args['credentials'])
+    gen_args = {'logfile': None, 'threshold': 1000, 'regexes': args['regexes'], 'max_rows': None, 'max_seconds': None,
+                'max_memory': None, 'collapse_prefixes': None}
+    input_store = open_input_store(args['inputs'])
+    try:
+        with db.connection() as conn:
+            start = perf_counter()
+            # fresh in-memory token cache, so that both runs tokenize everything
+            config_generator.synthesize_configs(args['origin'], conn, index, TokenCache(':memory:'), input_store,
+                                                gen_args)
+            return perf_counter() - start
+    finally:
+        input_store.close()
+        db.close()
+
+
+def main():
+    args = get_args()
+    start = perf_counter()
+    index = RegexIndex(args['regexes'])
+    print(f"Opening (and building if necessary) the index took {perf_counter() - start:.3f}s")
+
+    if args['origin'] is None:
+        with open(args['regexes']) as file:
+            keys = list(json.load(file))
+        # mix hits and misses, since most inline scripts do not belong to a multi-element cluster
+        clusters = [random.choice(keys) if random.random() < 0.5 else f'/data/outputs/missing/{i}'
+                    for i in range(args['lookups'])]
+        before = _time_lookups(_JsonReloadIndex(args['regexes']), clusters)
+        after = _time_lookups(index, clusters)
+    else:
+        before = _time_origin(_JsonReloadIndex(args['regexes']), args)
+        after = _time_origin(index, args)
+
+    print(f"Before (JSON reloaded per lookup): {before:.3f}s")
+    print(f"After (shared SQLite index): {after:.3f}s")
+    print(f"Speedup: {before / after if after else float('inf'):.1f}x")
+
+
+if __name__ == '__main__':
+    main()
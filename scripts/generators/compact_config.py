@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import struct
+
+# file layout: MAGIC, version byte, skeleton length, minified JSON skeleton, hash count, raw 32-byte hashes
+MAGIC = b'TTCF'
+VERSION = 1
+EXTENSION = '.ttc'
+# allowlists holding hex sha256 hashes, stored as [offset, count] into the hash block
+HASH_KEYS = {'hashes', 'dataHashes'}
+HASH_SIZE = 32
+
+
+def _key(key):
+    # json.dumps writes a NULL party as "null", the compact file is keyed the same way
+    return 'null' if key is None else key
+
+
+def _raw_hash(value_hash):
+    raw = bytes.fromhex(value_hash)
+    if len(raw) != HASH_SIZE:
+        raise ValueError(f"{value_hash} is not a sha256 hash")
+    return raw
+
+
+def normalize_config(config):
+    # what a reader of the JSON config gets, with every allowlist sorted and deduplicated
+    if isinstance(config, dict):
+        normalized = {}
+        for key, value in config.items():
+            # like json.load, a later duplicate key replaces an earlier one
+            normalized[_key(key)] = normalize_config(value)
+        return normalized
+    if isinstance(config, list):
+        return sorted(set(config))
+    return config
+
+
+def _encode_policy(policy, regex_ids, hashes):
+    encoded = {}
+    for key, value in sorted(policy.items()):
+        if isinstance(value, dict):
+            encoded[key] = _encode_policy(value, regex_ids, hashes)
+        elif key in HASH_KEYS:
+            encoded[key] = [len(hashes), len(value)]
+            hashes.extend(_raw_hash(value_hash) for value_hash in value)
+        elif key == 'regexes':
+            encoded[key] = [regex_ids[regex] for regex in value]
+        else:
+            # prefixes end up sorted, so entries sharing a prefix are next to each other, ready to be put in a trie
+            encoded[key] = value
+    return encoded
+
+
+def _collect_regexes(policy, regexes):
+    for key, value in policy.items():
+        if isinstance(value, dict):
+            _collect_regexes(value, regexes)
+        elif key == 'regexes':
+            regexes.update(value)
+
+
+def encode_config(config):
+    config = normalize_config(config)
+    hashes, parties = [], {}
+    for party in sorted(key for key in config if key != 'ignoreList'):
+        # one regex table per party, shared by the inline scripts of TrustedHTML and by TrustedScript
+        regexes = set()
+        _collect_regexes(config[party], regexes)
+        regexes = sorted(regexes)
+        regex_ids = {regex: i for i, regex in enumerate(regexes)}
+        parties[party] = {'regexes': regexes, 'types': _encode_policy(config[party], regex_ids, hashes)}
+    skeleton = json.dumps({'ignoreList': config.get('ignoreList', []), 'parties': parties},
+                          separators=(',', ':'), sort_keys=True).encode()
+    return b''.join([MAGIC, struct.pack('>BI', VERSION, len(skeleton)), skeleton, struct.pack('>I', len(hashes)),
+                     *hashes])
+
+
+def _decode_policy(encoded, regexes, hashes):
+    policy = {}
+    for key, value in encoded.items():
+        if isinstance(value, dict):
+            policy[key] = _decode_policy(value, regexes, hashes)
+        elif key in HASH_KEYS:
+            offset, count = value
+            if offset < 0 or count < 0 or offset + count > len(hashes):
+                raise ValueError(f"Hash range {value} outside of the {len(hashes)} stored hashes")
+            policy[key] = [value_hash.hex() for value_hash in hashes[offset:offset + count]]
+        elif key == 'regexes':
+            if any(not 0 <= regex_id < len(regexes) for regex_id in value):
+                raise ValueError(f"Regex index outside of the {len(regexes)} regexes of the party")
+            policy[key] = [regexes[regex_id] for regex_id in value]
+        else:
+            policy[key] = value
+    return policy
+
+
+def decode_config(data):
+    header_size = len(MAGIC) + struct.calcsize('>BI')
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a compact config, magic bytes are missing")
+    version, skeleton_size = struct.unpack_from('>BI', data, len(MAGIC))
+    if version != VERSION:
+        raise ValueError(f"Unsupported compact config version {version}")
+    hash_offset = header_size + skeleton_size + struct.calcsize('>I')
+    if len(data) < hash_offset:
+        raise ValueError("Compact config is truncated")
+    skeleton = json.loads(data[header_size:header_size + skeleton_size])
+    count, = struct.unpack_from('>I', data, header_size + skeleton_size)
+    if len(data) != hash_offset + count * HASH_SIZE:
+        raise ValueError(f"Expected {count * HASH_SIZE} bytes of hashes, found {len(data) - hash_offset}")
+    hashes = [data[i:i + HASH_SIZE] for i in range(hash_offset, len(data), HASH_SIZE)]
+    config = {}
+    for party, entry in skeleton['parties'].items():
+        config[party] = _decode_policy(entry['types'], entry['regexes'], hashes)
+    config['ignoreList'] = skeleton['ignoreList']
+    return config
+
+
+def write_compact_config(path, config, only_changed=False):
+    content = encode_config(config)
+    if only_changed and os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return False
+    with open(path, 'wb') as f:
+        f.write(content)
+    return True
+
+
+def load_compact_config(path):
+    with open(path, 'rb') as f:
+        return decode_config(f.read())
+
+
+def validate_compact_config(compact_path, json_path):
+    # the compact file has to describe exactly the same policy as the JSON config next to it
+    try:
+        compact = load_compact_config(compact_path)
+    except (ValueError, KeyError, TypeError, struct.error) as err:
+        return [f"{compact_path} can't be loaded: {err}"]
+    with open(json_path) as f:
+        expected = normalize_config(json.load(f))
+    if normalize_config(compact) != expected:
+        return [f"{compact_path} doesn't match {json_path}"]
+    return []
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Convert generated JSON configs into compact configs and validate them')
+    parser.add_argument('-d', '--directory', default='/data/configs',
+                        help='Directory containing the *_config.json files')
+    parser.add_argument('--validate-only', action='store_true',
+                        help='Only check existing compact configs against their JSON configs')
+    return vars(parser.parse_args())
+
+
+def main():
+    args = get_args()
+    problems, json_size, compact_size = [], 0, 0
+    files = sorted(file for file in os.listdir(args['directory']) if file.endswith('.json'))
+    for file in files:
+        json_path = os.path.join(args['directory'], file)
+        compact_path = json_path[:-len('.json')] + EXTENSION
+        if not args['validate_only']:
+            with open(json_path) as f:
+                write_compact_config(compact_path, json.load(f), only_changed=True)
+        problems += validate_compact_config(compact_path, json_path)
+        json_size += os.path.getsize(json_path)
+        if os.path.exists(compact_path):
+            compact_size += os.path.getsize(compact_path)
+    for problem in problems:
+        print(problem)
+    print(f"Checked {len(files)} configs, {len(problems)} problems")
+    print(f"JSON configs: {json_size} bytes, compact configs: {compact_size} bytes")
+
+
+if __name__ == '__main__':
+    main()
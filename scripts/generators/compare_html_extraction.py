@@ -0,0 +1,60 @@
+import argparse
+from itertools import islice
+
+from bs4 import BeautifulSoup
+
+from html_extract import extract_elements
+from input_store import open_input_store
+
+
+def _bs4_elements(html):
+    # what config_generator used to see when walking the BeautifulSoup tree
+    elements = []
+    for tag in BeautifulSoup(html, "html.parser").find_all(True):
+        attrs = {key: value for key, value in tag.attrs.items() if key == 'src' or key.startswith('on')}
+        if tag.name in ('script', 'iframe') or any(key.startswith('on') for key in attrs):
+            elements.append((tag.name, attrs, str(tag.string) if tag.name == 'script' and tag.string else None))
+    return elements
+
+
+def _streamed_elements(html):
+    return [(elem.name, elem.attrs, elem.string if elem.name == 'script' else None) for elem in extract_elements(html)]
+
+
+def compare(html):
+    expected, actual = _bs4_elements(html), _streamed_elements(html)
+    return expected == actual, expected, actual
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Compare the streaming script extraction with BeautifulSoup')
+    parser.add_argument('-i', '--inputs', default='/data/inputs',
+                        help='Path to the input store whose inputs are used as corpus')
+    parser.add_argument('--hashes', default=None,
+                        help='File with one input hash per line, e.g. all TrustedHTML inputs, all inputs if omitted')
+    parser.add_argument('-n', '--limit', default=None, type=int,
+                        help='Maximum number of inputs to compare')
+    return vars(parser.parse_args())
+
+
+def main():
+    args = get_args()
+    store = open_input_store(args['inputs'])
+    if args['hashes'] is not None:
+        with open(args['hashes']) as file:
+            hashes = [line.strip() for line in file if line.strip()]
+    else:
+        hashes = store
+    total, mismatches = 0, 0
+    for input_hash, html in store.get_many(islice(hashes, args['limit'])):
+        total += 1
+        same, expected, actual = compare(html)
+        if not same:
+            mismatches += 1
+            print(f"Mismatch for input {input_hash}:\n  bs4:       {expected}\n  streaming: {actual}")
+    store.close()
+    print(f"Compared {total} inputs, {mismatches} mismatches")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,35 @@
 import argparse
 import json
+import os
 from base64 import b64decode
 from hashlib import sha256
+from collections import Counter
+from contextlib import nullcontext
+from itertools import groupby
+from multiprocessing import Pool
+from operator import itemgetter
 from sys import stderr
+from time import perf_counter
 from urllib.parse import urlparse
 
 import psycopg2
-from bs4 import BeautifulSoup
-from esprima import tokenize, error_handler
+from psycopg2.extensions import QueryCanceledError
 from tqdm import tqdm
 
+from compact_config import EXTENSION, write_compact_config
+from config_manifest import ConfigManifest, load_manifest
+from db import close_databases, get_database
+from html_extract import extract_elements
+from input_store import open_input_store
+from origin_budget import OVER_BUDGET_POLICIES, BudgetExceeded, OriginBudget, defer_origin, load_origins
+from prefix_trie import PrefixPolicy, compact_prefixes
+from profiling import PROFILE_ENV, profile_path, profiler
+from regex_index import ensure_regex_index, load_regex_index
+from token_cache import load_token_cache
+
+# rows fetched per round trip by the server-side cursor of --bulk
+BULK_ITERSIZE = 10000
+
 
 def positive_int(value):
     try:
@@ -21,6 +41,16 @@ def positive_int(value):
     return value
 
 
+def non_negative_int(value):
+    try:
+        value = int(value)
+        if value < 0:
+            raise argparse.ArgumentTypeError(f"Negative value {value} given as parameter")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Non-number value {value} given as parameter")
+    return value
+
+
 def json_path(path):
     with open(path) as f:
         try:
@@ -42,9 +72,45 @@ def get_args():
                         help='Number of required allowlist entries above which a party is allowed to write any input for that Trusted Type')
     parser.add_argument('-r', '--regexes', default='/data/outputs/regexes.json', type=json_path,
                         help='Path to JSON file containing regexes used in the generation')
+    parser.add_argument('-i', '--inputs', default='/data/inputs',
+                        help='Path to the input store, either the sharded input directory or a packed store created by input_store.py')
+    parser.add_argument('-k', '--token-cache', default='/data/token_cache.sqlite',
+                        help='Path to the token-type hash cache shared with regex_generator, created if it does not exist')
     parser.add_argument('-p', '--processes', default=100, type=positive_int,
-                        help='Number of processes to be used in the generation')
+                        help='Number of worker processes to be used in the generation, 1 runs everything in the main process')
+    parser.add_argument('-b', '--bulk', action='store_true',
+                        help='Stream all inputs of a database through one server-side cursor instead of querying them per origin, party and Trusted Type')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only rebuild sub-policies whose input hashes changed since the last incremental run and only rewrite changed configs')
+    parser.add_argument('-m', '--manifest', default='/data/config_manifest.sqlite',
+                        help='Path to the manifest of input hashes and sub-policies used by --incremental')
+    parser.add_argument('--max-rows', default=1000000, type=positive_int,
+                        help='Number of distinct (party, Trusted Type, input) rows above which an origin is over budget')
+    parser.add_argument('--over-budget', default='chunk', choices=OVER_BUDGET_POLICIES,
+                        help='Generate origins over budget by streaming their inputs in chunks or only defer them')
+    parser.add_argument('--max-seconds', default=None, type=positive_int,
+                        help='Number of seconds after which the generation of an origin is given up on and the origin is deferred')
+    parser.add_argument('--max-memory', default=None, type=positive_int,
+                        help='Number of MB a worker may grow by while generating one origin before the origin is deferred')
+    parser.add_argument('--spill-after', default=100000, type=positive_int,
+                        help='Number of entries above which an allowlist of an origin over budget is moved to disk')
+    parser.add_argument('--deferred', default='/data/deferred_origins.txt',
+                        help='Path to the queue of deferred origins, emptied at the start of every run')
+    parser.add_argument('--origins', default=None,
+                        help='Only generate the origins listed in this file, e.g. the deferral queue of an earlier run, '
+                             'always queried per origin')
+    parser.add_argument('--collapse-prefixes', default=None, type=positive_int,
+                        help='Replace script URLs by their directory once it holds at least this many of them, off by default')
+    parser.add_argument('--prefix-min-depth', default=1, type=non_negative_int,
+                        help='Number of path segments a collapsed directory has to keep at least, 0 allows collapsing up to the host, '
+                             'prefixes without host always keep one')
+    parser.add_argument('--compact', action='store_true',
+                        help=f'Additionally write every config as compact {EXTENSION} file, see compact_config.py')
+    parser.add_argument('--profile', nargs='?', const='/data/config_profile.json', default=None,
+                        help=f'Record time, calls and bytes per stage, origin and Trusted Type and write a JSON summary '
+                             f'to the given path, also enabled by setting {PROFILE_ENV} to a path')
     args = parser.parse_args()
+    args.profile = profile_path(args.profile)
 
     return vars(args)
 
@@ -63,9 +129,9 @@ def _merge_configs(old_config, new_config):
         # add key and its value to original dict
         if key not in old_config:
             old_config[key] = new_config[key]
-        # update value to concatenation of both lists
+        # update value to the sorted union of both lists, an entry seen in several databases is kept once
         elif isinstance(old_config[key], list):
-            old_config[key] = old_config[key] + new_config[key]
+            old_config[key] = sorted(set(old_config[key]).union(new_config[key]))
         # update flag value to OR of both values
         elif isinstance(old_config[key], bool):
             old_config[key] = old_config[key] | new_config[key]
@@ -73,27 +139,55 @@ def _merge_configs(old_config, new_config):
             _merge_configs(old_config[key], new_config[key])
 
 
-def _get_config_html(conn, cursor, party_origin, origin, logfile, threshold, regex_path):
-    cursor.execute(
-        "SELECT DISTINCT input_hash FROM tt_data WHERE party_origin=%s AND trusted_type='TrustedHTML' AND origin =%s;",
-        (party_origin, origin))
-    values = cursor.fetchall()
-    regexes = set()
-    script_hashes = set()
-    prefixes = set()
-    for val, in values:
-        with open(f'/data/inputs/{val[0:2]}/{val}.txt') as file:
-            inp = file.read()
+def _party_order(item):
+    # NULL parties last and the ignoreList at the very end, the rest by name
+    key = item[0]
+    return key == 'ignoreList', key is None, key or ''
+
+
+def _sort_policy(policy):
+    # the modes keep their order, the enforcer tries them in the order they are written
+    return {key: _sort_policy(value) if isinstance(value, dict) else sorted(value) if isinstance(value, list) else value
+            for key, value in policy.items()}
+
+
+def _sort_config(config):
+    return {party: dict(sorted((_type, _sort_policy(policy)) for _type, policy in types.items()))
+            if isinstance(types, dict) else types for party, types in sorted(config.items(), key=_party_order)}
+
+
+def _final_count(prefixes, prefix_policy):
+    return len(prefixes) if prefix_policy is None else 0
+
+
+def _compact_prefixes(prefixes, prefix_policy):
+    if prefix_policy is None:
+        return prefixes
+    compacted = compact_prefixes(prefixes, prefix_policy)
+    work_counters['collapsed prefixes'] += len(prefixes) - len(compacted)
+    return compacted
+
 
+def _get_config_html(party_origin, origin, inputs, logfile, threshold, regex_index, token_cache, budget,
+                     prefix_policy):
+    regexes = budget.new_set()
+    script_hashes = budget.new_set()
+    prefixes = budget.new_set()
+    for val, inp in inputs:
+        # above the threshold the party may write anything, the remaining inputs can't change that anymore
+        # collapsing may still shrink the prefixes, so they only count once they are final
+        if len(regexes) + _final_count(prefixes, prefix_policy) + len(script_hashes) > threshold:
+            break
+        budget.check()
         if inp.startswith('http'):
             print_warning(
                 f"URL-like input {inp} found, written by party_origin {party_origin} to origin {origin}, "
                 f"skipping this input", logfile)
             continue
 
-        parsed = BeautifulSoup(inp, "html.parser")
-
-        for tag in parsed.find_all(True):
+        with profiler.stage('html parse', inp):
+            elements = extract_elements(inp)
+        for tag in elements:
             if tag.name == 'script':
                 # allowlist prefixes of external scripts
                 if 'src' in tag.attrs and tag['src']:
@@ -114,47 +208,46 @@ def _get_config_html(conn, cursor, party_origin, origin, logfile, threshold, reg
                         prefixes.add(val)
                 # allowlist inline scripts
                 elif tag.string:
-                    try:
-                        token_string = ''.join(token.type for token in tokenize(tag.string))
-                        token_hash = sha256(token_string.encode()).hexdigest()
-                    except error_handler.Error:
+                    with profiler.stage('tokenize', tag.string):
+                        script_hash, token_hash = token_cache.snippet_hashes(tag.string)
+                    if token_hash is None:
                         with open('config_errors.txt', 'a') as f:
                             f.write(f"Couldn't tokenize input {tag.string}\n")
-                            script_hashes.add(sha256(tag.string.encode()).hexdigest())
+                            script_hashes.add(script_hash)
                             continue
 
                     origin = origin if origin != 'null' else '//null'
                     party_origin = party_origin if party_origin != 'null' else '//null'
                     cluster = f"/data/outputs/{origin.split('/')[2]}/{party_origin.split('/')[2]}/{token_hash}"
-                    with open(regex_path) as file:
-                        content = json.load(file)
-                        try:
-                            regexes.add(content[cluster])
-                        except KeyError:
-                            script_hashes.add(sha256(tag.string.encode()).hexdigest())
+                    with profiler.stage('regex lookup'):
+                        regex = regex_index.get(cluster)
+                    if regex is not None:
+                        regexes.add(regex)
+                    else:
+                        script_hashes.add(script_hash)
 
             # allowlist event handlers
             for attr in tag.attrs:
                 if attr.startswith('on') and tag[attr]:
-                    try:
-                        token_string = ''.join(token.type for token in tokenize(tag[attr]))
-                        token_hash = sha256(token_string.encode()).hexdigest()
-                    except error_handler.Error:
+                    with profiler.stage('tokenize', tag[attr]):
+                        script_hash, token_hash = token_cache.snippet_hashes(tag[attr])
+                    if token_hash is None:
                         with open('config_errors.txt', 'a') as f:
                             f.write(f"Couldn't tokenize input {tag[attr]}\n")
-                            script_hashes.add(sha256(tag[attr].encode()).hexdigest())
+                            script_hashes.add(script_hash)
                             continue
 
                     origin = origin if origin != 'null' else '//null'
                     party_origin = party_origin if party_origin != 'null' else '//null'
                     cluster = f"/data/outputs/{origin.split('/')[2]}/{party_origin.split('/')[2]}/{token_hash}"
-                    with open(regex_path) as file:
-                        content = json.load(file)
-                        try:
-                            regexes.add(content[cluster])
-                        except KeyError:
-                            script_hashes.add(sha256(tag[attr].encode()).hexdigest())
+                    with profiler.stage('regex lookup'):
+                        regex = regex_index.get(cluster)
+                    if regex is not None:
+                        regexes.add(regex)
+                    else:
+                        script_hashes.add(script_hash)
 
+    prefixes = _compact_prefixes(prefixes, prefix_policy)
     if len(regexes) + len(prefixes) + len(script_hashes) > threshold:
         return {'TrustedHTML': {
             'scripts': {
@@ -176,20 +269,18 @@ def _get_config_html(conn, cursor, party_origin, origin, logfile, threshold, reg
         }
 
 
-def _get_config_script(conn, cursor, party_origin, origin, logfile, threshold, regex_path):
-    cursor.execute(
-        "SELECT DISTINCT input_hash FROM tt_data WHERE party_origin=%s AND trusted_type='TrustedScript' AND origin =%s;",
-        (party_origin, origin))
-    regexes = set()
-    hashes = set()
-    values = cursor.fetchall()
-    for val, in values:
-        with open(f"/data/inputs/{val[0:2]}/{val}.txt") as file:
-            inp = file.read()
-        try:
-            token_string = ''.join(token.type for token in tokenize(inp))
-            token_hash = sha256(token_string.encode()).hexdigest()
-        except error_handler.Error:
+def _get_config_script(party_origin, origin, inputs, logfile, threshold, regex_index, token_cache, budget,
+                       prefix_policy):
+    regexes = budget.new_set()
+    hashes = budget.new_set()
+    for val, inp in inputs:
+        if len(regexes) + len(hashes) > threshold:
+            break
+        budget.check()
+        # input hashes are the sha256 of the input, so they double as cache keys
+        with profiler.stage('tokenize', inp):
+            token_hash = token_cache.token_hash(inp, val)
+        if token_hash is None:
             with open('config_errors.txt', 'a') as f:
                 f.write(f"Couldn't tokenize input {inp}\n")
                 hashes.add(val)
@@ -198,12 +289,12 @@ def _get_config_script(conn, cursor, party_origin, origin, logfile, threshold, r
         origin = origin if origin != 'null' else '//null'
         party_origin = party_origin if party_origin != 'null' else '//null'
         cluster = f"/data/outputs/{origin.split('/')[2]}/{party_origin.split('/')[2]}/{token_hash}"
-        with open(regex_path) as file:
-            content = json.load(file)
-            try:
-                regexes.add(content[cluster])
-            except KeyError:
-                hashes.add(val)
+        with profiler.stage('regex lookup'):
+            regex = regex_index.get(cluster)
+        if regex is not None:
+            regexes.add(regex)
+        else:
+            hashes.add(val)
 
     if len(regexes) + len(hashes) > threshold:
         return {
@@ -212,51 +303,50 @@ def _get_config_script(conn, cursor, party_origin, origin, logfile, threshold, r
         return {'TrustedScript': {'regexes': list(regexes), 'hashes': list(hashes)}}
 
 
-def _get_config_script_url(conn, cursor, party_origin, origin, logfile, threshold, regex_path):
-    cursor.execute(
-        "SELECT DISTINCT input_hash FROM tt_data WHERE party_origin=%s AND trusted_type='TrustedScriptURL' AND origin =%s;",
-        (party_origin, origin))
-
-    data_hashes = set()
-    prefixes = set()
-    values = cursor.fetchall()
-    for val, in values:
-        with open(f'/data/inputs/{val[0:2]}/{val}.txt') as file:
-            url = file.read().strip()
-
-            if url.startswith('data:'):
-                seperator_index = url.find(',')
-                prefix = url[:seperator_index]
-                data = url[seperator_index + 1:]
-                if 'base64' in prefix:
-                    data = b64decode(data).decode()
-                # get hash of data URLs' content
-                hasher = sha256()
-                hasher.update(data.encode())
-                val = hasher.hexdigest()
-                data_hashes.add(val)
-                continue
+def _get_config_script_url(party_origin, origin, inputs, logfile, threshold, regex_index, token_cache, budget,
+                           prefix_policy):
+    data_hashes = budget.new_set()
+    prefixes = budget.new_set()
+    for val, url in inputs:
+        if len(data_hashes) + _final_count(prefixes, prefix_policy) > threshold:
+            break
+        budget.check()
+        url = url.strip()
+
+        if url.startswith('data:'):
+            seperator_index = url.find(',')
+            prefix = url[:seperator_index]
+            data = url[seperator_index + 1:]
+            if 'base64' in prefix:
+                data = b64decode(data).decode()
+            # get hash of data URLs' content
+            hasher = sha256()
+            hasher.update(data.encode())
+            val = hasher.hexdigest()
+            data_hashes.add(val)
+            continue
 
-            if url.startswith('blob:'):
-                url = url[5:]
+        if url.startswith('blob:'):
+            url = url[5:]
 
-            # allowlist URLs pointing to local resources without potential GET params
-            try:
-                url = urlparse(url)
-            except Exception as err:
-                with open('config_errors.txt', 'a') as f:
-                    f.write(f"Exception {err} occured from input\n{url}")
-                    continue
-            if not url.scheme:
-                if not url.netloc and url.path:
-                    prefixes.add(url.path)
-                elif url.netloc:
-                    val = f"//{url.netloc}{url.path}"
-                    prefixes.add(val)
-            else:
-                val = f"{url.scheme}://{url.netloc}{url.path}"
+        # allowlist URLs pointing to local resources without potential GET params
+        try:
+            url = urlparse(url)
+        except Exception as err:
+            with open('config_errors.txt', 'a') as f:
+                f.write(f"Exception {err} occured from input\n{url}")
+                continue
+        if not url.scheme:
+            if not url.netloc and url.path:
+                prefixes.add(url.path)
+            elif url.netloc:
+                val = f"//{url.netloc}{url.path}"
                 prefixes.add(val)
+        else:
+            val = f"{url.scheme}://{url.netloc}{url.path}"
+            prefixes.add(val)
 
+    prefixes = _compact_prefixes(prefixes, prefix_policy)
     if len(data_hashes) + len(prefixes) > threshold:
         return {'TrustedScriptURL': {'dataHashes': [], 'prefixes': [], 'allow-any': True}}
     else:
@@ -267,83 +357,341 @@ types_dict = {'TrustedHTML': _get_config_html, 'TrustedScript': _get_config_scri
               'TrustedScriptURL': _get_config_script_url}
 
 
-def _connect(credentials_path, names=None):
-    print('Connecting to database...')
-    with open(credentials_path) as file:
-        credentials = json.load(file)
-        user, passw, name, host, port = credentials.values()
-    if names is not None:
-        for name in names:
-            print('Connection successfully established')
-            yield psycopg2.connect(user=user, password=passw, host=host, port=port,
-                                   database=name), user, passw, name, host, port
-    else:
-        connection = psycopg2.connect(user=user, password=passw, host=host, port=port, database=name)
-        print('Connection successfully established')
-        yield connection, user, passw, name, host, port
+def _query_origin_inputs(conn, origin, max_rows=None):
+    # all inputs of an origin in one round trip, None if it has more than max_rows distinct rows
+    # the limit makes the server stop right after the row that puts the origin over budget
+    inputs = {}
+    with conn.cursor() as cursor:
+        query = "SELECT DISTINCT party_origin, trusted_type, input_hash FROM tt_data WHERE origin=%s"
+        if max_rows is not None:
+            cursor.execute(query + " LIMIT %s;", (origin, max_rows + 1))
+        else:
+            cursor.execute(query + ";", (origin,))
+        if max_rows is not None and cursor.rowcount > max_rows:
+            return None
+        for party_origin, trusted_type, input_hash in cursor:
+            values = inputs.setdefault(party_origin, {}).setdefault(trusted_type, [])
+            # party_origin=NULL never matched in the former per-party queries, keep the result the same here
+            if party_origin is not None:
+                values.append(input_hash)
+    return inputs
+
+
+def _limit_query_time(conn, budget):
+    # queries can't check the budget themselves, the server cancels them once the time budget of the origin is used up
+    remaining = budget.remaining_seconds()
+    if remaining is not None:
+        with conn.cursor() as cursor:
+            # only until the transaction ends, the connection is rolled back after every origin
+            cursor.execute("SET LOCAL statement_timeout = %s;", (max(1, int(remaining * 1000)),))
+
+
+def _stream_origin_inputs(conn, origin):
+    # inputs of an origin over budget, the hashes of each (party, Trusted Type) are handed out while they are fetched
+    with conn.cursor(name='tt_data_origin_stream') as cursor:
+        cursor.itersize = BULK_ITERSIZE
+        cursor.execute(
+            "SELECT DISTINCT party_origin, trusted_type, input_hash FROM tt_data WHERE origin=%s ORDER BY party_origin, trusted_type, input_hash;",
+            (origin,))
+        for (party_origin, trusted_type), rows in groupby(cursor, key=itemgetter(0, 1)):
+            # party_origin=NULL never matches in the per-origin queries, keep the result the same here
+            yield party_origin, trusted_type, (input_hash for _, _, input_hash in rows if party_origin is not None)
+
+
+def _stream_inputs(conn, max_rows=None, over_budget=None):
+    # one server-side cursor for the whole database, rows are fetched in batches of itersize
+    with conn.cursor(name='tt_data_stream') as cursor:
+        cursor.itersize = BULK_ITERSIZE
+        cursor.execute(
+            "SELECT DISTINCT origin, party_origin, trusted_type, input_hash FROM tt_data ORDER BY origin, party_origin, trusted_type, input_hash;")
+        start = perf_counter()
+        for origin, rows in groupby(cursor, key=itemgetter(0)):
+            inputs, count = {}, 0
+            for _, party_origin, trusted_type, input_hash in rows:
+                count += 1
+                if max_rows is not None and count > max_rows:
+                    # drop what was collected, the origin is generated on its own after the stream
+                    inputs = None
+                    over_budget.append(origin)
+                    break
+                values = inputs.setdefault(party_origin, {}).setdefault(trusted_type, [])
+                # party_origin=NULL never matches in the per-origin queries, keep the result the same here
+                if party_origin is not None:
+                    values.append(input_hash)
+            if inputs is None:
+                start = perf_counter()
+                continue
+            # fetching the rows of an origin is its share of the streamed query
+            profiler.set_context(origin)
+            profiler.record('sql', perf_counter() - start)
+            yield origin, inputs
+            start = perf_counter()
 
 
-def synthesize_configs(origin, configs, args, user, passw, name, host, port):
-    conn = None
-    try:
-        conn = psycopg2.connect(user=user, password=passw, host=host, port=port, database=name)
-        with conn.cursor() as cursor:
-            config = {}
-            # this one has way too many entries
-            if 'worldmeters.info' in origin:
-                return
-            query = "SELECT DISTINCT party_origin, ARRAY_AGG(trusted_type) FROM (SELECT DISTINCT party_origin, trusted_type FROM tt_data WHERE origin=%s) AS foo GROUP BY party_origin;"
-            cursor.execute(query, (origin,))
-            for party_origin, types_array in cursor.fetchall():
-                tt_dict = {}
-                for _type in types_array:
-                    tt_dict.update(
-                        types_dict[_type](conn, cursor, party_origin, origin, args['logfile'], args['threshold'],
-                                          args['regexes']))
-
-                config.update({party_origin: tt_dict})
-            config.update({'ignoreList': []})
-            if origin not in configs:
-                configs[origin] = config
-            else:
-                _merge_configs(configs[origin], config)
+# sub-policies and inputs the handlers didn't need to look at, reported at the end of the generation
+work_counters = Counter()
+
 
+def synthesize_configs(origin, conn, regex_index, token_cache, input_store, args, inputs=None, manifest=None):
+    subpolicies = None
+    try:
+        profiler.set_context(origin)
+        budget = OriginBudget(args['max_seconds'], max_megabytes=args['max_memory'])
+        prefix_policy = PrefixPolicy(args['collapse_prefixes'], args['prefix_min_depth']) \
+            if args['collapse_prefixes'] is not None else None
+        if inputs is None:
+            with profiler.stage('sql'):
+                _limit_query_time(conn, budget)
+                inputs = _query_origin_inputs(conn, origin, args['max_rows'])
+            budget.check_time()
+            budget.check_memory()
+            if inputs is None:
+                if args['over_budget'] == 'defer':
+                    defer_origin(args['deferred'], origin, f"more than {args['max_rows']} rows")
+                    return None
+                print_warning(f"Origin {origin} has more than {args['max_rows']} rows, generating it in chunks",
+                              args['logfile'])
+                # only the allowlists are kept, and those move to disk once they grow too large
+                budget.spill_after = args['spill_after']
+                # chunked origins are always rebuilt, their input hashes are never held in memory at once
+                manifest = None
+                subpolicies = _stream_origin_inputs(conn, origin)
+        if subpolicies is None:
+            subpolicies = ((party_origin, _type, values)
+                           for party_origin, types in inputs.items() for _type, values in types.items())
+        config = {}
+        for party_origin, _type, values in subpolicies:
+            profiler.set_context(origin, _type)
+            # in incremental mode, sub-policies whose input hashes are unchanged are taken from the manifest
+            sub_config = manifest.get(origin, party_origin, _type, values) if manifest is not None else None
+            if sub_config is None:
+                checked = budget.checked
+                sub_config = types_dict[_type](party_origin, origin,
+                                               profiler.timed_reads(input_store.get_many(values)),
+                                               args['logfile'], args['threshold'], regex_index, token_cache, budget,
+                                               prefix_policy)
+                if sub_config[_type].get('allow-any'):
+                    work_counters['allow-any'] += 1
+                    # the hashes of chunked origins are streamed, so their skipped inputs can't be counted
+                    if isinstance(values, list) and budget.checked - checked < len(values):
+                        work_counters['short-circuited'] += 1
+                        work_counters['skipped inputs'] += len(values) - (budget.checked - checked)
+                if manifest is not None:
+                    manifest.put(origin, party_origin, _type, values, sub_config)
+            config.setdefault(party_origin, {}).update(sub_config)
+        config.update({'ignoreList': []})
+        return config
+
+    except (BudgetExceeded, QueryCanceledError) as error:
+        # a query running past the time budget is cancelled by the server through its statement_timeout
+        reason = str(error) if isinstance(error, BudgetExceeded) else f"took longer than {args['max_seconds']}s"
+        print_warning(f"Origin {origin} {reason}, deferring it to {args['deferred']}", args['logfile'])
+        defer_origin(args['deferred'], origin, reason)
+        return None
     except psycopg2.Error as error:
-        print("Error while connecting to PostgreSQL: \n", str(error))
+        print(f"Error while generating config for origin {origin}: \n", str(error))
+        # keep the long-lived connection usable for the next origin
+        if conn is not None:
+            conn.rollback()
+        return None
+    finally:
+        if subpolicies is not None:
+            # closes the server-side cursor of a chunked origin that was given up on
+            subpolicies.close()
+
+
+# state of the current (worker) process, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(args):
+    profiler.enable(args['profile'])
+    _worker.update({'regex_index': load_regex_index(args['regexes']), 'input_store': open_input_store(args['inputs']),
+                    'token_cache': load_token_cache(args['token_cache']), 'args': args,
+                    'manifest': load_manifest(args['manifest'], args['run']) if args['incremental'] else None})
+
+
+def _close_worker():
+    close_databases()
+    _worker.pop('input_store').close()
+
+
+def _synthesize_in_worker(item):
+    database, origin, inputs = item
+    # origins of the bulk stream come with their inputs, the others are queried by the worker
+    # every worker has a pool per database, whose connection stays open for the next origin of that database
+    db = get_database(_worker['args']['credentials'], database) if inputs is None else None
+    with db.connection() if db is not None else nullcontext() as conn:
+        config = synthesize_configs(origin, conn, _worker['regex_index'], _worker['token_cache'],
+                                    _worker['input_store'], _worker['args'], inputs, _worker['manifest'])
+    # pool workers are terminated without cleanup, so persist newly tokenized inputs after every origin
+    _worker['token_cache'].flush()
+    if _worker['manifest'] is not None:
+        _worker['manifest'].flush()
+    return origin, config, _take_counters(), profiler.take()
+
+
+def _take_counters():
+    # counters of this process since the last origin, summed up by the parent
+    counters = Counter(work_counters)
+    work_counters.clear()
+    counters['snippet hits'], counters['snippet misses'] = _worker['token_cache'].take_snippet_counts()
+    return counters
+
+
+def _run_generation(work, func, processes, init_args, total):
+    if processes == 1 or total <= 1:
+        # fallback: process everything in this process
+        _init_worker(*init_args)
+        try:
+            yield from map(func, work)
+        finally:
+            _close_worker()
+    else:
+        processes = min(processes, total)
+        chunksize = max(1, total // (processes * 16))
+        with Pool(processes, initializer=_init_worker, initargs=init_args) as pool:
+            yield from pool.imap_unordered(func, work, chunksize=chunksize)
+
+
+def _bulk_work(args, db):
+    over_budget = []
+    with db.connection() as conn:
+        for origin, inputs in _stream_inputs(conn, args['max_rows'], over_budget):
+            yield db.name, origin, inputs
+    # origins above --max-rows were left out of the stream, they are chunked or deferred by the workers themselves
+    for origin in over_budget:
+        yield db.name, origin, None
+
+
+def _interleave(iterables):
+    # round robin over the work of every database, so all of them are worked on from the start
+    iterators = [iter(iterable) for iterable in iterables]
+    while iterators:
+        for iterator in list(iterators):
+            try:
+                yield next(iterator)
+            except StopIteration:
+                iterators.remove(iterator)
+
+
+def _regexes_digest(path):
+    # regex_generator rewrites the file on every run, even a resumed one, and in the order its clusters finished
+    # so only its content decides whether the sub-policies have to be rebuilt
+    with open(path) as file:
+        content = json.load(file)
+    return sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def _generation_fingerprint(args):
+    # everything besides the input hashes that influences the generated sub-policies
+    return json.dumps({'threshold': args['threshold'],
+                       'prefixes': [args['collapse_prefixes'], args['prefix_min_depth']],
+                       'regexes': _regexes_digest(args['regexes'])})
 
 
 def init_generation(args):
-    # manager = Manager()
-    # configs = manager.dict()
     configs = {}
-    conn = None
+    manifest = None
+    counters = Counter()
+    if args['incremental']:
+        manifest = ConfigManifest(args['manifest'])
+        args = dict(args, run=manifest.begin_run(_generation_fingerprint(args)))
+    # read before the deferral queue is emptied, it may be the very same file
+    only_origins = set(load_origins(args['origins'])) if args['origins'] is not None else None
+    open(args['deferred'], 'w').close()
     try:
-        for conn, user, passw, name, host, port in _connect(args['credentials'], args['databases']):
-            with conn.cursor() as cursor:
-                query = "SELECT DISTINCT origin FROM tt_data;"
-                cursor.execute(query)
-                origins = [(origin[0], configs, args, user, passw, name, host, port)
-                           for origin in cursor.fetchall()]
-            # with Pool(args['processes']) as pool:
-            #    pool.starmap(synthesize_configs, origins)
-            for origin in tqdm(origins, desc='Generating configs'):
-                synthesize_configs(*origin)
+        work, total, present = [], 0, set()
+        for name in args['databases'] or [None]:
+            db = get_database(args['credentials'], name)
+            origins = [origin for origin, in db.query("SELECT DISTINCT origin FROM tt_data;")]
+            if only_origins is not None:
+                origins = [origin for origin in origins if origin in only_origins]
+            # workers open their own connections, don't let them inherit this one
+            db.close()
+            total += len(origins)
+            present.update(origins)
+            if args['bulk'] and only_origins is None:
+                work.append(_bulk_work(args, db))
+            else:
+                work.append([(db.name, origin, None) for origin in origins])
+        # build the index once up front instead of racing in every worker
+        ensure_regex_index(args['regexes'])
+        # the origins of all databases share one pool of workers, instead of one database after the other
+        results = _run_generation(_interleave(work), _synthesize_in_worker, args['processes'], (args,), total)
+        # origins deferred or failed in any of the databases
+        incomplete = set()
+        names = ', '.join(name for name in args['databases'] or []) or 'the database'
+        for origin, config, origin_counters, stats in tqdm(results, total=total,
+                                                            desc=f'Generating configs from {names}'):
+            counters.update(origin_counters)
+            profiler.merge(stats)
+            if config is None:
+                incomplete.add(origin)
+                continue
+            profiler.set_context(origin)
+            with profiler.stage('merge'):
+                if origin not in configs:
+                    configs[origin] = config
+                else:
+                    _merge_configs(configs[origin], config)
+        # the allowlists come out of sets, so the written configs are the same for any order of the databases
+        configs = {origin: _sort_config(config) for origin, config in configs.items()}
+        snippets = counters['snippet hits'] + counters['snippet misses']
+        if snippets > 0:
+            print(f"Interned {counters['snippet misses']} distinct HTML snippets, {counters['snippet hits']} of "
+                  f"{snippets} snippets were hits ({round(counters['snippet hits'] / snippets * 100, 2)}%)")
+        if args['collapse_prefixes'] is not None:
+            print(f"Collapsed {counters['collapsed prefixes']} script URL prefixes into their directories")
+        print(f"{counters['allow-any']} sub-policies allow any input, {counters['short-circuited']} of them stopped "
+              f"early at the threshold and skipped {counters['skipped inputs']} inputs")
+        deferred = set(load_origins(args['deferred']))
+        if deferred:
+            print(f'Deferred {len(deferred)} origins over budget to {args["deferred"]}, '
+                  f'generate them with --origins {args["deferred"]}')
+        if manifest is not None:
+            # with --origins, origins left out of the list may well still be in the databases
+            reused, rebuilt = manifest.finish_run(set(configs) - incomplete,
+                                                  present if only_origins is None else None)
+            print(f'Reused {reused} unchanged sub-policies, rebuilt {rebuilt}')
         return configs
     except psycopg2.Error as error:
         print("Error while connecting to PostgreSQL: \n", str(error))
     finally:
-        if conn is not None:
-            conn.close()
+        close_databases()
+        if manifest is not None:
+            manifest.close()
         print('Connection to database successfully closed')
 
 
+def _write_config(path, data, only_changed=False):
+    content = json.dumps(data, indent=4)
+    if only_changed and os.path.exists(path):
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    with open(path, 'w') as f:
+        f.write(content)
+    return True
+
+
 def main():
-    configs_map = init_generation(get_args())
+    args = get_args()
+    profiler.enable(args['profile'])
+    configs_map = init_generation(args)
+    written = 0
     for origin, data in configs_map.items():
+        profiler.set_context(origin)
         if origin != 'null':
             origin = (urlparse(origin)).netloc
-        with open(f'/data/configs/{origin}_config.json', 'w') as f:
-            json.dump(data, f, indent=4)
+        with profiler.stage('json dump'):
+            written += _write_config(f'/data/configs/{origin}_config.json', data, args['incremental'])
+        if args['compact']:
+            with profiler.stage('compact dump'):
+                write_compact_config(f'/data/configs/{origin}_config{EXTENSION}', data, args['incremental'])
+    print(f'Wrote {written}/{len(configs_map)} configs')
+    if args['profile'] is not None:
+        profiler.write(args['profile'])
 
 
 if __name__ == '__main__':
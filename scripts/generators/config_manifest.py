@@ -0,0 +1,100 @@
+import json
+import os
+import sqlite3
+from hashlib import sha256
+
+
+def _key(origin, party_origin, trusted_type):
+    # JSON keeps NULL parties apart from the literal 'null' origin
+    return json.dumps([origin, party_origin, trusted_type])
+
+
+def inputs_digest(input_hashes):
+    return sha256('\n'.join(sorted(input_hashes)).encode()).hexdigest()
+
+
+class ConfigManifest:
+    # remembers which input hashes produced each (origin, party, Trusted Type) sub-policy of the current configs
+
+    def __init__(self, path, run=None):
+        self.path = path
+        self.run = run
+        self.conn = sqlite3.connect(path, timeout=60)
+        # written by every generator process
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS subpolicies (key TEXT NOT NULL, inputs_digest TEXT NOT NULL, input_hashes TEXT NOT NULL, subpolicy TEXT NOT NULL, run INTEGER NOT NULL, built INTEGER NOT NULL, PRIMARY KEY (key, inputs_digest)) WITHOUT ROWID;")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, fingerprint TEXT NOT NULL);")
+        self.conn.commit()
+        self.used, self.added = [], []
+
+    def begin_run(self, fingerprint):
+        last = self.conn.execute("SELECT fingerprint FROM runs ORDER BY run DESC LIMIT 1;").fetchone()
+        # different threshold or regexes, none of the stored sub-policies can be trusted anymore
+        if last is not None and last[0] != fingerprint:
+            self.conn.execute("DELETE FROM subpolicies;")
+        self.run = self.conn.execute("INSERT INTO runs (fingerprint) VALUES (?);", (fingerprint,)).lastrowid
+        self.conn.commit()
+        return self.run
+
+    def get(self, origin, party_origin, trusted_type, input_hashes):
+        key, digest = _key(origin, party_origin, trusted_type), inputs_digest(input_hashes)
+        row = self.conn.execute("SELECT subpolicy FROM subpolicies WHERE key=? AND inputs_digest=?;",
+                                (key, digest)).fetchone()
+        if row is None:
+            return None
+        self.used.append((self.run, key, digest))
+        return json.loads(row[0])
+
+    def put(self, origin, party_origin, trusted_type, input_hashes, subpolicy):
+        key, digest = _key(origin, party_origin, trusted_type), inputs_digest(input_hashes)
+        self.added.append((key, digest, json.dumps(sorted(input_hashes)), json.dumps(subpolicy), self.run, self.run))
+
+    def flush(self):
+        if self.used or self.added:
+            self.conn.executemany("UPDATE subpolicies SET run=? WHERE key=? AND inputs_digest=?;", self.used)
+            self.conn.executemany("INSERT OR REPLACE INTO subpolicies VALUES (?, ?, ?, ?, ?, ?);", self.added)
+            self.conn.commit()
+            self.used, self.added = [], []
+
+    def _origins_table(self, name, origins):
+        self.conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {name} (origin TEXT);")
+        self.conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_origin ON {name} (origin);")
+        self.conn.execute(f"DELETE FROM {name};")
+        self.conn.executemany(f"INSERT INTO {name} VALUES (?);", ((origin,) for origin in origins))
+
+    def finish_run(self, finished, present=None):
+        # only the origins generated completely in this run are pruned, deferred origins and the ones left out by
+        # --origins keep their sub-policies for the next run
+        self.flush()
+        self._origins_table('finished', finished)
+        # sub-policies of input sets that no longer occur in the databases
+        self.conn.execute("DELETE FROM subpolicies WHERE run != ? AND EXISTS "
+                          "(SELECT 1 FROM finished WHERE origin IS json_extract(subpolicies.key, '$[0]'));",
+                          (self.run,))
+        if present is not None:
+            # origins that aren't in any database anymore
+            self._origins_table('present', present)
+            self.conn.execute("DELETE FROM subpolicies WHERE run != ? AND NOT EXISTS "
+                              "(SELECT 1 FROM present WHERE origin IS json_extract(subpolicies.key, '$[0]'));",
+                              (self.run,))
+        self.conn.commit()
+        reused, rebuilt = self.conn.execute(
+            "SELECT COUNT(*) FILTER (WHERE built != run), COUNT(*) FILTER (WHERE built = run) FROM subpolicies "
+            "WHERE run = ?;", (self.run,)).fetchone()
+        return reused, rebuilt
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+# one manifest per process and path, sqlite connections must not be shared across forks
+_manifests = {}
+
+
+def load_manifest(path, run):
+    key = (os.getpid(), os.path.abspath(path))
+    if key not in _manifests:
+        _manifests[key] = ConfigManifest(path, run)
+    return _manifests[key]
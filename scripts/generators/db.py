@@ -0,0 +1,81 @@
+import json
+import os
+from contextlib import contextmanager
+
+from psycopg2.pool import ThreadedConnectionPool
+
+CREDENTIALS_PATH = '/data/credentials.json'
+# connections a pool keeps open at most, per database and process
+MAX_CONNECTIONS = 4
+# rows fetched per round trip by server-side cursors
+ITERSIZE = 10000
+
+
+def load_credentials(path=CREDENTIALS_PATH):
+    # the values are read in their order: user, password, database, host and port
+    with open(path) as file:
+        user, passw, name, host, port = json.load(file).values()
+    return {'user': user, 'password': passw, 'database': name, 'host': host, 'port': port}
+
+
+class Database:
+    # pooled connections to one database, a connection is reused for every query until the pool is closed
+
+    def __init__(self, params, max_connections=MAX_CONNECTIONS):
+        self.params = params
+        self.name = params['database']
+        self.max_connections = max_connections
+        self.pool = None
+
+    @contextmanager
+    def connection(self):
+        if self.pool is None:
+            self.pool = ThreadedConnectionPool(0, self.max_connections, **self.params)
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            # everything here only reads, ending the transaction keeps idle connections out of long transactions
+            if not conn.closed:
+                conn.rollback()
+            self.pool.putconn(conn, close=bool(conn.closed))
+
+    def query(self, query, params=None):
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+    def stream(self, query, params=None, itersize=ITERSIZE):
+        # server-side cursor, rows are fetched in batches of itersize instead of all at once
+        with self.connection() as conn, conn.cursor(name='db_stream') as cursor:
+            cursor.itersize = itersize
+            cursor.execute(query, params)
+            yield from cursor
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
+
+
+# one pool per process, credentials and database, connections must not be shared across forks
+_databases = {}
+
+
+def get_database(credentials_path=CREDENTIALS_PATH, name=None):
+    # name overrides the database of the credentials file
+    key = (os.getpid(), os.path.abspath(credentials_path), name)
+    if key not in _databases:
+        params = load_credentials(credentials_path)
+        if name is not None:
+            params['database'] = name
+        _databases[key] = Database(params)
+    return _databases[key]
+
+
+def close_databases():
+    pid = os.getpid()
+    for key, database in list(_databases.items()):
+        if key[0] == pid:
+            database.close()
+            del _databases[key]
@@ -0,0 +1,85 @@
+from html.parser import HTMLParser
+
+# tags BeautifulSoup closes right away and tags whose whitespace-only strings it keeps as they are
+_VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta',
+              'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex',
+              'nextid', 'spacer'}
+_PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+_ASCII_SPACES = set('\x20\x0a\x09\x0c\x0d')
+
+
+class Element:
+    # the part of a bs4 Tag the generators look at: name, src and on* attributes and the string of scripts
+
+    __slots__ = ('name', 'attrs', 'string')
+
+    def __init__(self, name, attrs, string=None):
+        self.name = name
+        self.attrs = attrs
+        self.string = string
+
+    def __getitem__(self, key):
+        return self.attrs[key]
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+
+class _ScriptExtractor(HTMLParser):
+    # the html.parser tokenizer BeautifulSoup uses, without building a tree
+
+    def __init__(self):
+        # bs4 doesn't convert character references either, script bodies are kept as they are
+        super().__init__(convert_charrefs=False)
+        self.elements = []
+        self.open_tags = []
+        self.script, self.script_data = None, []
+
+    def handle_starttag(self, tag, attrs):
+        relevant = {}
+        for key, value in attrs:
+            if key == 'src' or key.startswith('on'):
+                # later duplicates replace earlier ones and valueless attributes are empty, just like in bs4
+                relevant[key] = value if value is not None else ''
+        if tag == 'script':
+            self.script, self.script_data = Element(tag, relevant), []
+            self.elements.append(self.script)
+        elif tag == 'iframe' or any(key.startswith('on') for key in relevant):
+            self.elements.append(Element(tag, relevant))
+        if tag not in _VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_data(self, data):
+        if self.script is not None:
+            self.script_data.append(data)
+
+    def _finish_script(self):
+        data = ''.join(self.script_data)
+        if data and all(c in _ASCII_SPACES for c in data) and not _PRESERVE_WHITESPACE_TAGS & set(self.open_tags):
+            data = '\n' if '\n' in data else ' '
+        self.script.string = data or None
+        self.script, self.script_data = None, []
+
+    def handle_endtag(self, tag):
+        if tag == 'script' and self.script is not None:
+            self._finish_script()
+        # like bs4, an end tag closes everything opened after the matching start tag and is ignored without one
+        if tag in self.open_tags:
+            del self.open_tags[len(self.open_tags) - 1 - self.open_tags[::-1].index(tag):]
+
+    def close(self):
+        super().close()
+        if self.script is not None:
+            self._finish_script()
+
+
+def extract_elements(html):
+    # scripts, iframes and elements with event handlers in document order
+    parser = _ScriptExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.elements
@@ -0,0 +1,207 @@
+import argparse
+import mmap
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+INDEX_NAME = 'index.sqlite'
+SEGMENT_NAME = 'segment-%05d.bin'
+# segments are rolled over once they would grow beyond this size
+SEGMENT_SIZE = 1 << 30
+# number of hashes looked up / read together by get_many
+BATCH_SIZE = 512
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class DirectoryInputStore:
+    # the layout written by the crawler: one file per input in <base_dir>/<first two hash chars>/<hash>.txt
+
+    def __init__(self, base_dir, threads=16):
+        self.base_dir = base_dir
+        self.threads = threads
+        self.executor = None
+
+    def _path(self, input_hash):
+        return os.path.join(self.base_dir, input_hash[0:2], f'{input_hash}.txt')
+
+    def get(self, input_hash):
+        try:
+            with open(self._path(input_hash)) as file:
+                return file.read()
+        except FileNotFoundError:
+            raise KeyError(input_hash) from None
+
+    def get_many(self, hashes):
+        # single files cannot be batched, but reading several at once hides the latency of network storage
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.threads)
+        for batch in _batches(hashes, BATCH_SIZE):
+            yield from zip(batch, self.executor.map(self.get, batch))
+
+    def __iter__(self):
+        for shard in sorted(os.listdir(self.base_dir)):
+            shard_dir = os.path.join(self.base_dir, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for file in sorted(os.listdir(shard_dir)):
+                if file.endswith('.txt'):
+                    yield file[:-4]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class PackedInputStore:
+    # few large append-only segment files plus an index mapping each hash to (segment, offset, length)
+
+    def __init__(self, path):
+        self.path = path
+        self.index = sqlite3.connect(f'file:{os.path.join(path, INDEX_NAME)}?mode=ro', uri=True,
+                                     check_same_thread=False)
+        self.segments = {}
+
+    def _segment(self, segment, end):
+        mapping = self.segments.get(segment)
+        # a mapping only covers the segment as it was when mapped, inputs appended later by a writer lie past it
+        if mapping is None or len(mapping) < end:
+            if mapping is not None:
+                mapping.close()
+            name = SEGMENT_NAME % segment
+            with open(os.path.join(self.path, name), 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                if size < end:
+                    raise ValueError(f"{name} ends at byte {size}, before the end of an indexed input at {end}")
+                mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.segments[segment] = mapping
+        return mapping
+
+    def _read(self, segment, offset, length):
+        # an empty input may be all a segment holds, and empty files can't be mapped
+        if length == 0:
+            return ''
+        return self._segment(segment, offset + length)[offset:offset + length].decode()
+
+    def get(self, input_hash):
+        row = self.index.execute("SELECT segment, offset, length FROM inputs WHERE hash=?;", (input_hash,)).fetchone()
+        if row is None:
+            raise KeyError(input_hash)
+        return self._read(*row)
+
+    def get_many(self, hashes):
+        for batch in _batches(hashes, BATCH_SIZE):
+            query = f"SELECT hash, segment, offset, length FROM inputs WHERE hash IN ({','.join('?' * len(batch))});"
+            locations = {row[0]: row[1:] for row in self.index.execute(query, batch)}
+            for input_hash in batch:
+                if input_hash not in locations:
+                    raise KeyError(input_hash)
+            # read in segment order so that the page cache is walked sequentially
+            for input_hash in sorted(set(batch), key=locations.get):
+                yield input_hash, self._read(*locations[input_hash])
+
+    def __iter__(self):
+        for input_hash, in self.index.execute("SELECT hash FROM inputs ORDER BY segment, offset;"):
+            yield input_hash
+
+    def close(self):
+        for segment in self.segments.values():
+            segment.close()
+        self.segments = {}
+        self.index.close()
+
+
+class PackedInputStoreWriter:
+
+    def __init__(self, path, segment_size=SEGMENT_SIZE):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segment_size = segment_size
+        self.index = sqlite3.connect(os.path.join(path, INDEX_NAME))
+        self.index.execute(
+            "CREATE TABLE IF NOT EXISTS inputs (hash TEXT PRIMARY KEY, segment INTEGER NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL) WITHOUT ROWID;")
+        self.segment = self.index.execute("SELECT COALESCE(MAX(segment), 0) FROM inputs;").fetchone()[0]
+        self.file = None
+        self._open_segment()
+
+    def _open_segment(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(os.path.join(self.path, SEGMENT_NAME % self.segment), 'ab')
+        self.file.seek(0, os.SEEK_END)
+
+    def __contains__(self, input_hash):
+        return self.index.execute("SELECT 1 FROM inputs WHERE hash=?;", (input_hash,)).fetchone() is not None
+
+    def add(self, input_hash, content):
+        # inputs are content-addressed, so an existing entry never has to be rewritten
+        if input_hash in self:
+            return False
+        data = content.encode()
+        if self.file.tell() > 0 and self.file.tell() + len(data) > self.segment_size:
+            self.segment += 1
+            self._open_segment()
+        offset = self.file.tell()
+        self.file.write(data)
+        self.index.execute("INSERT INTO inputs VALUES (?, ?, ?, ?);", (input_hash, self.segment, offset, len(data)))
+        return True
+
+    def commit(self):
+        # data is flushed before the index, so a crash leaves at most unreferenced bytes in the segment
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.index.commit()
+
+    def close(self):
+        self.commit()
+        self.file.close()
+        self.index.close()
+
+
+def open_input_store(path):
+    if os.path.exists(os.path.join(path, INDEX_NAME)):
+        return PackedInputStore(path)
+    return DirectoryInputStore(path)
+
+
+def convert_directory_store(base_dir, packed_dir, commit_every=10000):
+    source = DirectoryInputStore(base_dir)
+    writer = PackedInputStoreWriter(packed_dir)
+    added = 0
+    try:
+        # already converted hashes are skipped without reading them, so this can be re-run after every crawl
+        new_hashes = (input_hash for input_hash in source if input_hash not in writer)
+        for input_hash, content in source.get_many(new_hashes):
+            writer.add(input_hash, content)
+            added += 1
+            if added % commit_every == 0:
+                writer.commit()
+    finally:
+        writer.close()
+        source.close()
+    return added
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Convert the sharded input directory into a packed input store')
+    parser.add_argument('source', nargs='?', default='/data/inputs',
+                        help='Path to the sharded input directory')
+    parser.add_argument('destination', nargs='?', default='/data/inputs_packed',
+                        help='Path to the packed input store, created if it does not exist')
+    return vars(parser.parse_args())
+
+
+def main():
+    args = get_args()
+    added = convert_directory_store(args['source'], args['destination'])
+    print(f"Added {added} inputs to packed store {args['destination']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import re
+from collections import defaultdict
+
+from compact_config import EXTENSION, write_compact_config
+from js_regex import compile_js_regex, test_js_regex
+from script_normalize import strip_comments_and_whitespace
+
+# an escaped character, a quantified character class or a plain character, the units generate_regex emits
+_UNIT = re.compile(r'\\[\s\S]|(?:\[(?:\\.|[^\]\\])*\]|\.)\{\d+(?:,\d+)?\}|[^\\\[\](){}|?*+.^$]')
+_GROUP = re.compile(r'\(\?:|\)\?|[|)]')
+
+
+def _parse_units(regex):
+    # ^...$ split into its units, None for regexes outside of what generate_regex emits
+    if len(regex) < 2 or not regex.startswith('^') or not regex.endswith('$'):
+        return None
+    body, units, i = regex[1:-1], [], 0
+    while i < len(body):
+        unit = _UNIT.match(body, i)
+        if unit is None:
+            return None
+        units.append(unit.group())
+        i = unit.end()
+    return tuple(units)
+
+
+def _build_trie(sequences):
+    trie = {}
+    for units in sequences:
+        node = trie
+        for unit in units:
+            node = node.setdefault(unit, {})
+        # None marks the end of a regex
+        node[None] = {}
+    return trie
+
+
+def _emit(trie):
+    # iterative pre-order, the units of long scripts would exceed the recursion limit
+    out, stack = [], [trie]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            continue
+        ends = None in item
+        units = sorted(unit for unit in item if unit is not None)
+        if not units:
+            continue
+        if len(units) == 1 and not ends:
+            # shared prefix, no alternative needed
+            stack += [item[units[0]], units[0]]
+            continue
+        parts = ['(?:']
+        for i, unit in enumerate(units):
+            if i:
+                parts.append('|')
+            parts += [unit, item[unit]]
+        # a regex ending here makes everything after the shared prefix optional
+        parts.append(')?' if ends else ')')
+        stack += reversed(parts)
+    return ''.join(out)
+
+
+def merge_regexes(regexes):
+    # one pattern accepting exactly the union of the regexes, None if one of them can't be split into units
+    sequences = set()
+    for regex in regexes:
+        units = _parse_units(regex)
+        if units is None:
+            return None
+        sequences.add(units)
+    return f"^{_emit(_build_trie(sequences))}$"
+
+
+def expand_merged(merged):
+    # every unit sequence a merged pattern accepts, the inverse of merge_regexes
+    body, i = merged[1:-1], 0
+    # per open group: finished alternatives and the sequences of the current one
+    frames = [(set(), {()})]
+    while i < len(body):
+        group = _GROUP.match(body, i)
+        if group is not None:
+            token, i = group.group(), group.end()
+            if token == '(?:':
+                frames.append((set(), {()}))
+            elif token == '|':
+                done, current = frames[-1]
+                frames[-1] = (done | current, {()})
+            else:
+                done, current = frames.pop()
+                alternatives = done | current | ({()} if token == ')?' else set())
+                outer_done, outer = frames[-1]
+                frames[-1] = (outer_done, {prefix + rest for prefix in outer for rest in alternatives})
+            continue
+        unit = _UNIT.match(body, i)
+        if unit is None:
+            raise ValueError(f"Unexpected character {body[i]!r} in merged regex")
+        done, current = frames[-1]
+        frames[-1] = (done, {prefix + (unit.group(),) for prefix in current})
+        i = unit.end()
+    if len(frames) != 1:
+        raise ValueError("Unbalanced groups in merged regex")
+    return frames[0][1]
+
+
+def verify_merged(regexes, merged, pattern, inputs=()):
+    # same language as the union of the regexes and every input of their clusters still matches
+    problems = []
+    if expand_merged(merged) != {_parse_units(regex) for regex in regexes}:
+        problems.append(f"merged regex {merged} doesn't accept exactly the union of {regexes}")
+    for inp in inputs:
+        if not test_js_regex(pattern, inp):
+            problems.append(f"input {inp} doesn't match merged regex {merged}")
+    return problems
+
+
+def _load_cluster_roots(path):
+    # (origin, party, regex) -> directories holding the inputs the regex was generated from
+    roots = defaultdict(list)
+    if path is None or not os.path.exists(path):
+        return roots
+    with open(path) as file:
+        for line in file:
+            entry = json.loads(line)
+            if entry['cluster'] is not None:
+                origin, party = entry['cluster'].split('/')[-3:-1]
+                roots[(origin, party, entry['regex'])].append(entry['root'])
+    return roots
+
+
+def _cluster_inputs(roots):
+    # normalized exactly like regex_generator did before generating the regex
+    for root in roots:
+        for file in os.listdir(root):
+            with open(os.path.join(root, file)) as f:
+                yield strip_comments_and_whitespace(f.read())
+
+
+def _merge_policy(policy, origin, party, cluster_roots, stats):
+    for key, value in policy.items():
+        if isinstance(value, dict):
+            _merge_policy(value, origin, party, cluster_roots, stats)
+        elif key == 'regexes' and len(value) > 1:
+            # duplicates collapse as well, a single distinct regex is emitted unchanged
+            merged = merge_regexes(value)
+            # without a Python translation the cluster inputs can't be checked, js2py is left to regex_generator
+            pattern = compile_js_regex(merged) if merged is not None else None
+            if pattern is None:
+                stats['unparsable'] += 1
+                continue
+            roots = [root for regex in set(value) for root in cluster_roots.get((origin, party, regex), [])]
+            problems = verify_merged(value, merged, pattern, _cluster_inputs(roots))
+            if problems:
+                with open('merge_errors.txt', 'a') as f:
+                    f.write('\n'.join(problems) + '\n')
+                stats['failed'] += 1
+                continue
+            stats['merged'] += 1
+            stats['regexes'] += len(value)
+            policy[key] = [merged]
+
+
+def merge_config(config, origin, cluster_roots, stats):
+    for party, policy in config.items():
+        if party == 'ignoreList':
+            continue
+        # cluster directories are named like config_generator names them
+        party_dir = party.split('/')[2] if party != 'null' else 'null'
+        _merge_policy(policy, origin, party_dir, cluster_roots, stats)
+    return config
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Merge the regexes of every party into one pattern per allowlist')
+    parser.add_argument('-d', '--directory', default='/data/configs',
+                        help='Directory containing the *_config.json files, they are rewritten in place')
+    parser.add_argument('-r', '--results', default='/data/regexes.jsonl',
+                        help='JSON Lines results of regex_generator, used to check the merged regexes against the '
+                             'inputs of their clusters')
+    parser.add_argument('--skip-inputs', action='store_true',
+                        help='Only check that the merged regexes accept exactly the union, not the cluster inputs')
+    return vars(parser.parse_args())
+
+
+def main():
+    args = get_args()
+    cluster_roots = _load_cluster_roots(None if args['skip_inputs'] else args['results'])
+    stats = defaultdict(int)
+    for file in sorted(os.listdir(args['directory'])):
+        if not file.endswith('_config.json'):
+            continue
+        path = os.path.join(args['directory'], file)
+        with open(path) as f:
+            config = json.load(f)
+        merged = stats['merged']
+        merge_config(config, file[:-len('_config.json')], cluster_roots, stats)
+        if stats['merged'] == merged:
+            continue
+        with open(path, 'w') as f:
+            json.dump(config, f, indent=4)
+        # keep the compact config next to it in sync
+        compact_path = path[:-len('.json')] + EXTENSION
+        if os.path.exists(compact_path):
+            write_compact_config(compact_path, config)
+    print(f"Merged {stats['regexes']} regexes into {stats['merged']} patterns")
+    print(f"{stats['failed']} allowlists failed verification and {stats['unparsable']} contained unknown regex syntax, "
+          f"both were kept as they were")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+from time import perf_counter
+
+# what to do with origins above --max-rows: stream them in chunks or only record them in the deferral queue
+OVER_BUDGET_POLICIES = ['chunk', 'defer']
+# the memory of the process is only looked at every this many inputs, reading it is a system call
+MEMORY_CHECK_INTERVAL = 1000
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def _resident_memory():
+    # resident set size of this process in bytes, None where /proc isn't available
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class SpillableSet:
+    # set of strings that moves to a temporary on-disk sqlite table once it holds more than limit entries
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.items = set()
+        self.conn = None
+        self.count = 0
+
+    def _spill(self):
+        # an empty file name gives a private temporary database that is deleted once it is closed
+        self.conn = sqlite3.connect('')
+        self.conn.execute("CREATE TABLE items (item TEXT PRIMARY KEY) WITHOUT ROWID;")
+        self.conn.executemany("INSERT INTO items VALUES (?);", ((item,) for item in self.items))
+        self.count = len(self.items)
+        self.items = None
+
+    def add(self, item):
+        if self.conn is None:
+            self.items.add(item)
+            if len(self.items) > self.limit:
+                self._spill()
+        else:
+            self.count += self.conn.execute("INSERT OR IGNORE INTO items VALUES (?);", (item,)).rowcount
+
+    def __len__(self):
+        return len(self.items) if self.conn is None else self.count
+
+    def __iter__(self):
+        if self.conn is None:
+            return iter(self.items)
+        return (item for item, in self.conn.execute("SELECT item FROM items;"))
+
+
+class OriginBudget:
+    # limits a single origin is generated under, the default one is unlimited
+
+    def __init__(self, max_seconds=None, spill_after=None, max_megabytes=None):
+        self.max_seconds = max_seconds
+        self.spill_after = spill_after
+        self.max_megabytes = max_megabytes
+        self.started = perf_counter()
+        # the memory a worker already holds doesn't count against the next origin
+        self.memory_start = _resident_memory() if max_megabytes is not None else None
+        # number of inputs the handlers looked at
+        self.checked = 0
+
+    def remaining_seconds(self):
+        if self.max_seconds is None:
+            return None
+        return self.max_seconds - (perf_counter() - self.started)
+
+    def check_time(self):
+        if self.max_seconds is not None and perf_counter() - self.started > self.max_seconds:
+            raise BudgetExceeded(f"took longer than {self.max_seconds}s")
+
+    def check_memory(self):
+        if self.memory_start is None:
+            return
+        memory = _resident_memory()
+        if memory is not None and memory - self.memory_start > self.max_megabytes * 1024 * 1024:
+            raise BudgetExceeded(f"used more than {self.max_megabytes} MB")
+
+    def check(self):
+        # called for every input, so that a pathological origin is given up on instead of stalling a worker
+        self.checked += 1
+        self.check_time()
+        if self.checked % MEMORY_CHECK_INTERVAL == 0:
+            self.check_memory()
+
+    def new_set(self):
+        return set() if self.spill_after is None else SpillableSet(self.spill_after)
+
+
+def defer_origin(path, origin, reason):
+    # one origin per line, a later run can pick them up with --origins
+    with open(path, 'a') as file:
+        file.write(f"{origin}\t{reason}\n")
+
+
+def load_origins(path):
+    with open(path) as file:
+        return [line.split('\t')[0] for line in file.read().splitlines() if line.strip()]
@@ -0,0 +1,88 @@
+class PrefixPolicy:
+    # how far allowlisted script URL prefixes may be generalized
+
+    def __init__(self, min_siblings, min_depth=1):
+        # a directory replaces its entries once it holds at least min_siblings of them
+        self.min_siblings = min_siblings
+        # but only if at least min_depth path segments are left, 0 allows collapsing up to the host
+        # prefixes without host keep at least one, the root path / would match protocol-relative URLs of any host
+        self.min_depth = min_depth
+
+
+def _split_root(prefix):
+    # scheme://netloc or //netloc, followed by the path, prefixes without host are paths only
+    if prefix.startswith('//'):
+        start = 2
+    else:
+        scheme_end = prefix.find('://')
+        if scheme_end == -1 or '/' in prefix[:scheme_end]:
+            return '', prefix
+        start = scheme_end + 3
+    end = prefix.find('/', start)
+    if end == -1:
+        return prefix, ''
+    return prefix[:end], prefix[end:]
+
+
+def _segments(path):
+    # directories keep their trailing slash: /lib/a.js -> ['/', 'lib/', 'a.js']
+    parts = path.split('/')
+    return [part + '/' for part in parts[:-1]] + ([parts[-1]] if parts[-1] else [])
+
+
+class _Node:
+
+    __slots__ = ('children', 'end')
+
+    def __init__(self):
+        self.children = {}
+        self.end = False
+
+
+def _insert(trie, prefix):
+    root, path = _split_root(prefix)
+    node = trie.setdefault(root, _Node())
+    for segment in _segments(path):
+        node = node.children.setdefault(segment, _Node())
+    node.end = True
+
+
+def _compact(node, segments, policy, min_depth):
+    for segment, child in node.children.items():
+        _compact(child, segments + [segment], policy, min_depth)
+    if node.end:
+        # the enforcer matches with startsWith, so everything below an allowlisted prefix is redundant
+        node.children = {}
+        return
+    if not segments or not segments[-1].endswith('/'):
+        return
+    depth = len(segments) - (1 if segments[0] == '/' else 0)
+    entries = sum(1 for child in node.children.values() if child.end)
+    if depth >= min_depth and entries >= policy.min_siblings:
+        node.end = True
+        node.children = {}
+
+
+def _collect(node, prefix, result):
+    if node.end:
+        result.append(prefix)
+    for segment, child in node.children.items():
+        _collect(child, prefix + segment, result)
+
+
+def compact_prefixes(prefixes, policy):
+    # collapses sibling URLs into their common directory bottom-up, returns the prefixes sorted
+    trie = {}
+    for prefix in prefixes:
+        _insert(trie, prefix)
+    result = []
+    for root, node in trie.items():
+        # the host itself is never the result of collapsing, an empty prefix would allow every URL
+        # without a host, / is the host: it would allow every protocol-relative URL like //attacker.example/x.js
+        min_depth = policy.min_depth if root else max(policy.min_depth, 1)
+        for segment, child in node.children.items():
+            _compact(child, [segment], policy, min_depth)
+        if node.end:
+            node.children = {}
+        _collect(node, root, result)
+    return sorted(result)
@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+from time import perf_counter
+
+# a path in this environment variable turns on profiling and is used if --profile isn't given
+PROFILE_ENV = 'TT_PROFILE'
+# number of origins listed in the summary and printed at the end of a profiled run
+SLOWEST_ORIGINS = 20
+# key of stages that happen outside of any origin or Trusted Type in the summary
+NO_CONTEXT = '-'
+
+
+def _size(data):
+    if data is None:
+        return 0
+    return len(data.encode()) if isinstance(data, str) else len(data)
+
+
+class _Stage:
+
+    __slots__ = ('profiler', 'name', 'data', 'start')
+
+    def __init__(self, profiler, name, data):
+        self.profiler, self.name, self.data = profiler, name, data
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, perf_counter() - self.start, self.data)
+        return False
+
+
+class _NoStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+class Profiler:
+    # wall time, calls and bytes per (origin, trusted type, stage), a no-op unless enabled
+
+    def __init__(self):
+        self.enabled = False
+        # per thread, --bulk streams inputs from the task thread of the pool while the main thread merges results
+        self.context = threading.local()
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def enable(self, enabled=True):
+        self.enabled = bool(enabled)
+
+    def set_context(self, origin=None, trusted_type=None):
+        # stages are attributed to the origin and Trusted Type currently being processed by this thread
+        self.context.origin, self.context.trusted_type = origin, trusted_type
+
+    def stage(self, name, data=None):
+        # data is only measured when profiling, so it costs nothing otherwise
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, name, data)
+
+    def record(self, name, seconds, data=None):
+        if not self.enabled:
+            return
+        key = (getattr(self.context, 'origin', None), getattr(self.context, 'trusted_type', None), name)
+        size = _size(data)
+        with self.lock:
+            entry = self.stats.setdefault(key, [0.0, 0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+            entry[2] += size
+
+    def timed_reads(self, pairs, name='file read'):
+        # times every (key, content) pair pulled from a lazy input store iterator
+        if not self.enabled:
+            return pairs
+        return self._timed_reads(pairs, name)
+
+    def _timed_reads(self, pairs, name):
+        pairs = iter(pairs)
+        while True:
+            start = perf_counter()
+            try:
+                key, content = next(pairs)
+            except StopIteration:
+                return
+            self.record(name, perf_counter() - start, content)
+            yield key, content
+
+    def take(self):
+        # stats collected since the last call, workers hand them to the parent together with their results
+        with self.lock:
+            stats, self.stats = self.stats, {}
+        return stats
+
+    def merge(self, stats):
+        with self.lock:
+            for key, (seconds, calls, size) in stats.items():
+                entry = self.stats.setdefault(key, [0.0, 0, 0])
+                entry[0] += seconds
+                entry[1] += calls
+                entry[2] += size
+
+    def summary(self, slowest=SLOWEST_ORIGINS):
+        stages, types, origins = {}, {}, {}
+        for (origin, trusted_type, name), (seconds, calls, size) in self.stats.items():
+            origin, trusted_type = origin or NO_CONTEXT, trusted_type or NO_CONTEXT
+            origin_entry = origins.setdefault(origin, {'seconds': 0.0, 'stages': {}, 'types': {}})
+            origin_entry['seconds'] += seconds
+            for totals in (stages, types.setdefault(trusted_type, {}), origin_entry['stages'],
+                           origin_entry['types'].setdefault(trusted_type, {})):
+                total = totals.setdefault(name, {'seconds': 0.0, 'calls': 0, 'bytes': 0})
+                total['seconds'] += seconds
+                total['calls'] += calls
+                total['bytes'] += size
+        slowest_origins = sorted((origin for origin in origins if origin != NO_CONTEXT),
+                                 key=lambda origin: origins[origin]['seconds'], reverse=True)[:slowest]
+        return {'stages': stages, 'types': types, 'origins': origins,
+                'slowest': [[origin, origins[origin]['seconds']] for origin in slowest_origins]}
+
+    def write(self, path, slowest=SLOWEST_ORIGINS):
+        summary = self.summary(slowest)
+        with open(path, 'w') as file:
+            json.dump(summary, file, indent=4, sort_keys=True)
+        print(f'Profile written to {path}')
+        for name, total in sorted(summary['stages'].items(), key=lambda item: item[1]['seconds'], reverse=True):
+            print(f"  {name}: {round(total['seconds'], 2)}s in {total['calls']} calls, {total['bytes']} bytes")
+        print(f'Slowest {len(summary["slowest"])} origins:')
+        for origin, seconds in summary['slowest']:
+            print(f'  {origin}: {round(seconds, 2)}s')
+
+
+def profile_path(value=None):
+    # --profile wins over the environment toggle
+    return value if value is not None else os.environ.get(PROFILE_ENV) or None
+
+
+# one profiler per process, pool workers return what they collected with every result
+profiler = Profiler()
@@ -0,0 +1,28 @@
+from re import search, escape, fullmatch
+
+REGEX_CLASSES = [r'[a-z]', r'[a-z0-9]', r'[a-zA-Z0-9]', r'[a-zA-Z0-9\"_;-]', r'.']
+# characters matched by each of REGEX_CLASSES, None for '.' which matches everything but newlines
+REGEX_CLASS_CHARS = [None if res == '.' else frozenset(c for c in map(chr, range(128)) if fullmatch(res, c))
+                     for res in REGEX_CLASSES]
+
+
+def get_regex_for_tuple(values):
+    # all values are equal, so just hardcode it
+    if all(val == values[0] for val in values):
+        return escape(values[0])
+    else:
+        # get input length range
+        min_val, max_val = min(map(len, values)), max(map(len, values))
+        quantifier = '{%d}' % min_val if min_val == max_val else '{%d,%d}' % (min_val, max_val)
+        joined = ''.join(values)
+        if '\n' in joined:
+            # $ also matches before a trailing newline, only the regex engine gets these rare values exactly right
+            for res in REGEX_CLASSES:
+                if all(search(f"^{res}{quantifier}$", inp) is not None for inp in values):
+                    return res + quantifier
+            return None
+        # the length range always fits, so the tightest class covering every character used is the answer
+        chars = set(joined)
+        for res, class_chars in zip(REGEX_CLASSES, REGEX_CLASS_CHARS):
+            if class_chars is None or chars <= class_chars:
+                return res + quantifier
@@ -1,12 +1,22 @@
+import argparse
 import os
-from hashlib import sha256
-from json import dump
-from re import search, escape, sub, DOTALL
+from json import dump, dumps, loads
+from multiprocessing import Pool
 
 from esprima import tokenize, error_handler
-from js2py import eval_js
 
-REGEX_CLASSES = [r'[a-z]', r'[a-z0-9]', r'[a-zA-Z0-9]', r'[a-zA-Z0-9\"_;-]', r'.']
+from config_generator import positive_int
+from js_regex import compile_js_regex, test_js_regex
+from profiling import PROFILE_ENV, profile_path, profiler
+from regex_classes import get_regex_for_tuple
+from script_normalize import strip_comments_and_whitespace
+from token_cache import load_token_cache
+
+# js2py is only needed for --cross-check and regexes outside of the translatable subset
+try:
+    from js2py import eval_js
+except ImportError:
+    eval_js = None
 
 if os.path.exists("/mnt/c/Users/Daniel"):
     BASE_DIR = "/mnt/c/Users/Daniel/tmp/tt/inputs"
@@ -19,6 +29,10 @@ elif os.path.exists("/home/node-crawler"):
 else:
     print("please add your BASE_DIR")
     exit(1)
+# shared with config_generator, kept outside of OUT_DIR so it isn't mistaken for a cluster
+TOKEN_CACHE = os.path.join(os.path.dirname(OUT_DIR), 'token_cache.sqlite')
+# one JSON line per processed cluster, regexes.json is assembled from it at the end
+RESULTS_PATH = os.path.join(os.path.dirname(OUT_DIR), 'regexes.jsonl')
 
 regex_js = """function evalRegex(regex, input) {
     regex = new RegExp(regex);
@@ -27,80 +41,187 @@ regex_js = """function evalRegex(regex, input) {
 """
 
 
-def _verify_inputs(inputs, regex, root):
-    for inp in inputs:
+def _verify_inputs(inputs, regex, root, cross_check=False):
+    # the regex is compiled once for the whole cluster, js2py is only used for constructs
+    # that can't be translated to Python or to cross-check the translation
+    pattern = compile_js_regex(regex)
+    check_regex = None
+    if pattern is None or cross_check:
+        if eval_js is None:
+            with open('regexes_errors.txt', 'a') as f:
+                f.write(f"regex \n\n {regex}\n\n from {root} can't be verified without js2py")
+            return False
         check_regex = eval_js(regex_js)
-        # assert check_regex(regex,
-        #                   inp), f"input \n\n {inp} did not match regex \n\n {regex}\n\n comes from {root}"
-        if not check_regex(regex, inp):
+    for inp in inputs:
+        if pattern is not None:
+            matched = test_js_regex(pattern, inp)
+            if cross_check and matched != check_regex(regex, inp):
+                with open('regexes_errors.txt', 'a') as f:
+                    f.write(f"Python and JS disagree on input \n\n {inp} for regex \n\n {regex}\n\n comes from {root}")
+        else:
+            matched = check_regex(regex, inp)
+        if not matched:
             with open('regexes_errors.txt', 'a') as f:
                 f.write(f"input \n\n {inp} did not match regex \n\n {regex}\n\n comes from {root}")
             return False
-        return True
+    return True
+
+
+def normalize_input(inp):
+    # the tokens returned are the ones generate_regex uses, they can't be taken from the normalizer: it only tokenizes
+    # inputs containing //, and before the whitespace is removed, which can merge tokens (var a -> vara)
+    val = strip_comments_and_whitespace(inp)
+    return val, tokenize(val)
 
 
 def normalize_inputs(inps):
     # remove any kind of whitespace and comments
-    normed_inps = []
-    for val in (sub(r'/\*.*\*/', '', inp, flags=DOTALL) for inp in inps):
-        for token in tokenize(val, options={'comment': True, 'tolerant': True}):
-            if token.type == 'LineComment':
-                val = val.replace(f'//{token.value}', '')
-        normed_inps.append(val)
-    return [sub(r'\s', '', inp) for inp in normed_inps]
-
-
-def get_regex_for_tuple(values):
-    # all values are equal, so just hardcode it
-    if all(val == values[0] for val in values):
-        return escape(values[0])
-    else:
-        # get input length range
-        min_val, max_val = len(min(values, key=lambda x: len(x))), len(max(values, key=lambda x: len(x)))
-        for res in REGEX_CLASSES:
-            if min_val == max_val:
-                res += '{%d}' % min_val
-            else:
-                res += '{%d,%d}' % (min_val, max_val)
-
-            if all(search(f"^{res}$", inp) is not None for inp in values):
-                return res
+    return [strip_comments_and_whitespace(inp) for inp in inps]
 
 
-def generate_regex(inputs):
+def generate_regex(inputs, tokens=None):
+    if tokens is None:
+        tokens = [tokenize(inp) for inp in inputs]
     regex = ''
-    for entry in zip(*(tokenize(inp) for inp in inputs)):
+    for entry in zip(*tokens):
         values = [token.value for token in entry]
         regex += get_regex_for_tuple(values)
 
     return f"^{regex}$"
 
 
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cross-check', action='store_true',
+                        help='Additionally verify every input with js2py and log disagreements with the Python regex engine')
+    parser.add_argument('-p', '--processes', default=os.cpu_count(), type=positive_int,
+                        help='Number of worker processes clusters are spread across, 1 runs everything in the main process')
+    parser.add_argument('--resume', action='store_true',
+                        help=f'Skip clusters already recorded in {RESULTS_PATH} by a previous (interrupted) run')
+    parser.add_argument('--profile', nargs='?', const=os.path.join(os.path.dirname(OUT_DIR), 'regex_profile.json'),
+                        default=None,
+                        help=f'Record time, calls and bytes per stage and origin and write a JSON summary to the given '
+                             f'path, also enabled by setting {PROFILE_ENV} to a path')
+    args = parser.parse_args()
+    args.profile = profile_path(args.profile)
+
+    return vars(args)
+
+
+def _read_cluster(root, files):
+    for file in files:
+        with open(os.path.join(root, file)) as f:
+            yield file, f.read()
+
+
+def _process_cluster(root, files, token_cache, cross_check=False):
+    dir = root[:root.rfind('/')]
+    # clusters live in OUT_DIR/<origin>/<party>/<token hash>
+    profiler.set_context(os.path.basename(os.path.dirname(dir)))
+    inputs = [inp for _, inp in profiler.timed_reads(_read_cluster(root, files))]
+    inputs_norm, tokens = [], []
+    try:
+        for inp in inputs:
+            with profiler.stage('tokenize', inp):
+                inp_norm, inp_tokens = normalize_input(inp)
+            inputs_norm.append(inp_norm)
+            tokens.append(inp_tokens)
+        with profiler.stage('regex generation'):
+            regex = generate_regex(inputs_norm, tokens)
+        with profiler.stage('verify'):
+            verified = _verify_inputs(inputs_norm, regex, root, cross_check)
+        if verified:
+            # all inputs in the same cluster have the same token types
+            with profiler.stage('tokenize', inputs[0]):
+                token_hash = token_cache.token_hash(inputs[0])
+            if token_hash is not None:
+                return dir + '/' + token_hash, regex
+            else:
+                with open('errors.txt', 'a') as file:
+                    file.write(f'Tokenizing error in \n{inputs[0]}\nfrom path {root}\n\n')
+    except error_handler.Error:
+        with open('errors.txt', 'a') as file:
+            file.write(f'Tokenizing error in \n{str(inputs_norm)}\nfrom path {root}\n\n')
+    return None, None
+
+
+def _find_clusters(skip):
+    for root, dirs, files in os.walk(OUT_DIR):
+        # OUT_DIR itself holds regexes.json and the SQLite index config_generator builds next to it, not inputs
+        if root == OUT_DIR:
+            continue
+        # clusters with a single input don't need a regex, their hash is allowlisted instead
+        if len(files) > 1 and root not in skip:
+            yield root, files
+
+
+# state of the current (worker) process, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(cross_check, profile=None):
+    profiler.enable(profile)
+    _worker.update({'token_cache': load_token_cache(TOKEN_CACHE), 'cross_check': cross_check})
+
+
+def _process_in_worker(cluster):
+    root, files = cluster
+    key, regex = _process_cluster(root, files, _worker['token_cache'], _worker['cross_check'])
+    # pool workers are terminated without cleanup, so persist newly tokenized inputs after every cluster
+    _worker['token_cache'].flush()
+    return root, key, regex, profiler.take()
+
+
+def _load_results(path):
+    # finished clusters of earlier runs, a line cut off by a crash is dropped
+    finished, offset = {}, 0
+    if not os.path.exists(path):
+        return finished
+    with open(path, 'rb') as file:
+        for line in file:
+            try:
+                entry = loads(line)
+            except ValueError:
+                break
+            finished[entry['root']] = entry
+            offset += len(line)
+    with open(path, 'r+b') as file:
+        file.truncate(offset)
+    return finished
+
+
+def _write_results(out, results):
+    for root, key, regex, stats in results:
+        profiler.merge(stats)
+        out.write(dumps({'root': root, 'cluster': key, 'regex': regex}) + '\n')
+        out.flush()
+
+
 def main():
+    args = get_args()
+    profiler.enable(args['profile'])
+    finished = _load_results(RESULTS_PATH) if args['resume'] else {}
+    clusters = _find_clusters(finished)
+    # every finished cluster is appended right away, so a crash loses no finished work
+    with open(RESULTS_PATH, 'a' if args['resume'] else 'w') as out:
+        if args['processes'] == 1:
+            _init_worker(args['cross_check'], args['profile'])
+            _write_results(out, map(_process_in_worker, clusters))
+        else:
+            with Pool(args['processes'], initializer=_init_worker,
+                      initargs=(args['cross_check'], args['profile'])) as pool:
+                _write_results(out, pool.imap_unordered(_process_in_worker, clusters))
+
     result = {}
-    for root, dirs, files in os.walk(OUT_DIR):
-        if len(files) >= 1:
-            dir = root[:root.rfind('/')]
-            if len(files) == 1:
-                continue
-            else:
-                inputs = []
-                for file in files:
-                    with open(os.path.join(root, file)) as f:
-                        inputs.append(f.read())
-                inputs_norm = normalize_inputs(inputs)
-                try:
-                    regex = generate_regex(inputs_norm)
-                    if _verify_inputs(inputs_norm, regex, root):
-                        # all inputs in the same cluster have the same token types
-                        token_string = ''.join(token.type for token in tokenize(inputs[0]))
-                        token_hash = sha256(token_string.encode()).hexdigest()
-                        result[dir + '/' + token_hash] = regex
-                except error_handler.Error:
-                    with open('errors.txt', 'a') as file:
-                        file.write(f'Tokenizing error in \n{str(inputs_norm)}\nfrom path {root}\n\n')
-    with open(os.path.join(OUT_DIR, 'regexes.json'), 'w') as file:
-        dump(result, file, indent=4)
+    for entry in _load_results(RESULTS_PATH).values():
+        if entry['cluster'] is not None:
+            result[entry['cluster']] = entry['regex']
+    profiler.set_context()
+    with profiler.stage('json dump'):
+        with open(os.path.join(OUT_DIR, 'regexes.json'), 'w') as file:
+            dump(result, file, indent=4)
+    if args['profile'] is not None:
+        profiler.write(args['profile'])
 
 
 if __name__ == '__main__':
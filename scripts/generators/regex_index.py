@@ -0,0 +1,68 @@
+import json
+import os
+import sqlite3
+
+# one open index per process and path, sqlite connections must not be shared across forks
+_indexes = {}
+
+
+def _index_path(regex_path):
+    return os.path.splitext(regex_path)[0] + '.sqlite'
+
+
+def build_regex_index(regex_path, index_path=None):
+    index_path = index_path or _index_path(regex_path)
+    tmp_path = index_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    with open(regex_path) as file:
+        content = json.load(file)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("CREATE TABLE regexes (cluster TEXT PRIMARY KEY, regex TEXT NOT NULL) WITHOUT ROWID;")
+        conn.executemany("INSERT INTO regexes VALUES (?, ?);", sorted(content.items()))
+        conn.commit()
+    finally:
+        conn.close()
+    # swap in atomically so concurrent readers never see a half-written index
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def ensure_regex_index(regex_path):
+    index_path = _index_path(regex_path)
+    # rebuild the index whenever the JSON file generated by regex_generator is newer
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(regex_path):
+        build_regex_index(regex_path, index_path)
+    return index_path
+
+
+class RegexIndex:
+
+    def __init__(self, regex_path):
+        index_path = ensure_regex_index(regex_path)
+        self.path = index_path
+        self.conn = sqlite3.connect(f'file:{index_path}?mode=ro', uri=True, check_same_thread=False)
+
+    def get(self, cluster):
+        row = self.conn.execute("SELECT regex FROM regexes WHERE cluster=?;", (cluster,)).fetchone()
+        return row[0] if row is not None else None
+
+    def __contains__(self, cluster):
+        return self.get(cluster) is not None
+
+    def __getitem__(self, cluster):
+        regex = self.get(cluster)
+        if regex is None:
+            raise KeyError(cluster)
+        return regex
+
+    def close(self):
+        self.conn.close()
+
+
+def load_regex_index(regex_path):
+    key = (os.getpid(), os.path.abspath(regex_path))
+    if key not in _indexes:
+        _indexes[key] = RegexIndex(regex_path)
+    return _indexes[key]
@@ -0,0 +1,19 @@
+from re import sub, DOTALL
+
+from esprima import tokenize
+
+
+def strip_comments_and_whitespace(inp):
+    # the block comment regex is the one the enforcer uses, so regexes keep matching its normalized inputs
+    val = sub(r'/\*.*\*/', '', inp, flags=DOTALL)
+    # without // there can't be any line comment, so skip tokenizing
+    if '//' in val:
+        parts, last = [], 0
+        for token in tokenize(val, options={'comment': True, 'tolerant': True, 'range': True}):
+            if token.type == 'LineComment':
+                start, end = token.range
+                parts.append(val[last:start])
+                last = end
+        parts.append(val[last:])
+        val = ''.join(parts)
+    return sub(r'\s', '', val)
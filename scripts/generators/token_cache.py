@@ -0,0 +1,100 @@
+import os
+import sqlite3
+from collections import OrderedDict
+from hashlib import sha256
+
+from esprima import tokenize, error_handler
+
+# pending results are written in one transaction once this many have been collected
+FLUSH_EVERY = 1000
+# total length of the snippets whose hashes are kept in memory by snippet_hashes, least recently used ones are dropped
+SNIPPET_BUDGET = 16 * 1024 * 1024
+
+
+def get_token_hash(source):
+    token_string = ''.join(token.type for token in tokenize(source))
+    return sha256(token_string.encode()).hexdigest()
+
+
+class TokenCache:
+    # token-type hashes of inputs keyed by the sha256 of their content, NULL marks inputs esprima can't tokenize
+
+    def __init__(self, path, snippet_budget=SNIPPET_BUDGET):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        # several generator processes read and write the same cache
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, token_hash TEXT) WITHOUT ROWID;")
+        self.conn.commit()
+        self.pending = {}
+        self.hits, self.misses = 0, 0
+        self.snippets, self.snippet_budget, self.snippet_size = OrderedDict(), snippet_budget, 0
+        self.snippet_hits, self.snippet_misses = 0, 0
+
+    def _lookup(self, key):
+        if key in self.pending:
+            return True, self.pending[key]
+        row = self.conn.execute("SELECT token_hash FROM tokens WHERE key=?;", (key,)).fetchone()
+        return (True, row[0]) if row is not None else (False, None)
+
+    def token_hash(self, source, key=None):
+        # inputs are content-addressed, so their input hash can be passed as key instead of hashing them again
+        if key is None:
+            key = sha256(source.encode()).hexdigest()
+        found, token_hash = self._lookup(key)
+        if found:
+            self.hits += 1
+            return token_hash
+        self.misses += 1
+        try:
+            token_hash = get_token_hash(source)
+        except error_handler.Error:
+            token_hash = None
+        self.pending[key] = token_hash
+        if len(self.pending) >= FLUSH_EVERY:
+            self.flush()
+        return token_hash
+
+    def snippet_hashes(self, snippet):
+        # scripts and event handlers extracted from HTML repeat across parties, intern both hashes per distinct snippet
+        hashes = self.snippets.get(snippet)
+        if hashes is not None:
+            self.snippets.move_to_end(snippet)
+            self.snippet_hits += 1
+            return hashes
+        self.snippet_misses += 1
+        key = sha256(snippet.encode()).hexdigest()
+        hashes = key, self.token_hash(snippet, key)
+        self.snippets[snippet] = hashes
+        self.snippet_size += len(snippet)
+        while self.snippet_size > self.snippet_budget and len(self.snippets) > 1:
+            evicted, _ = self.snippets.popitem(last=False)
+            self.snippet_size -= len(evicted)
+        return hashes
+
+    def take_snippet_counts(self):
+        # interning hits and misses since the last call, so that workers can report them per origin
+        counts = self.snippet_hits, self.snippet_misses
+        self.snippet_hits, self.snippet_misses = 0, 0
+        return counts
+
+    def flush(self):
+        if self.pending:
+            self.conn.executemany("INSERT OR IGNORE INTO tokens VALUES (?, ?);", self.pending.items())
+            self.conn.commit()
+            self.pending = {}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+# one cache per process and path, sqlite connections must not be shared across forks
+_caches = {}
+
+
+def load_token_cache(path):
+    key = (os.getpid(), os.path.abspath(path))
+    if key not in _caches:
+        _caches[key] = TokenCache(path)
+    return _caches[key]
@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import os
+import sys
+from collections import Counter
+from time import perf_counter
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Requests per second of the config endpoint under the ASGI application, '
+                                                 'with and without the in-memory config cache')
+    parser.add_argument('-d', '--directory', default='/data/configs',
+                        help='Directory containing the *_config.json files to serve')
+    parser.add_argument('-o', '--hosts', nargs='+', default=None,
+                        help='Hosts whose configs are requested in turn, defaults to every config in the directory')
+    parser.add_argument('-n', '--requests', default=5000, type=int,
+                        help='Number of requests per run')
+    parser.add_argument('-c', '--concurrency', default=32, type=int,
+                        help='Number of requests in flight at the same time')
+    parser.add_argument('-e', '--encoding', default='br, gzip',
+                        help='Accept-Encoding header sent with every request')
+    parser.add_argument('--revalidate', action='store_true',
+                        help='Send the ETag of the first response as If-None-Match, like a browser with a stale copy')
+    return vars(parser.parse_args())
+
+
+async def _request(application, path, headers):
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+             'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+             'headers': [(b'host', b'localhost')] + headers, 'client': ('127.0.0.1', 0), 'server': ('localhost', 80)}
+    response = {}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {name.lower(): value for name, value in message['headers']}
+
+    await application(scope, receive, send)
+    return response
+
+
+async def _run(application, paths, requests, concurrency, headers):
+    statuses, remaining = Counter(), iter(range(requests))
+
+    async def client():
+        for i in remaining:
+            path = paths[i % len(paths)]
+            response = await _request(application, path, headers.get(path, []))
+            statuses[response['status']] += 1
+
+    start = perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return perf_counter() - start, statuses
+
+
+async def _etags(application, paths, encoding):
+    headers = {}
+    for path in paths:
+        response = await _request(application, path, encoding)
+        headers[path] = encoding + [(b'if-none-match', response['headers'][b'etag'])]
+    return headers
+
+
+def main():
+    args = get_args()
+    # settings read the directory when the application is set up
+    os.environ['TT_CONFIG_DIR'] = args['directory']
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from testapp.asgi import application
+    from django.conf import settings
+    from testapp import views
+    from testapp.configs import ConfigCache
+
+    hosts = args['hosts'] or sorted(file[:-len('_config.json')] for file in os.listdir(args['directory'])
+                                    if file.endswith('_config.json'))
+    paths = [f'/configs/{host}.json' for host in hosts]
+    encoding = [(b'accept-encoding', args['encoding'].encode())]
+    for label, size in [('with cache', settings.CONFIG_CACHE_SIZE), ('without cache', 0)]:
+        views.config_cache = ConfigCache(size)
+        if args['revalidate']:
+            headers = asyncio.run(_etags(application, paths, encoding))
+        else:
+            headers = {path: encoding for path in paths}
+        # the first pass fills the cache, only the second one is measured
+        asyncio.run(_run(application, paths, len(paths), args['concurrency'], headers))
+        elapsed, statuses = asyncio.run(_run(application, paths, args['requests'], args['concurrency'], headers))
+        print(f"{label}: {args['requests'] / elapsed:.0f} requests/s over {len(paths)} configs, "
+              f"statuses {dict(sorted(statuses.items()))}")
+
+
+if __name__ == '__main__':
+    main()
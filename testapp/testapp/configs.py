@@ -0,0 +1,98 @@
+import gzip
+import os
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+
+# brotli is optional, without it clients get the gzip variant
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# encodings in the order they are preferred, if the client accepts them
+ENCODINGS = ['br', 'gzip']
+
+
+class ConfigVariants:
+    # a config file with its ETag and every encoding it is served in
+
+    def __init__(self, version, content):
+        self.version = version
+        self.etag = sha256(content).hexdigest()[:32]
+        self.bodies = {'identity': content, 'gzip': gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(content, mode=brotli.MODE_TEXT)
+
+    def etag_for(self, encoding):
+        # every representation needs its own strong ETag
+        return f'"{self.etag}"' if encoding == 'identity' else f'"{self.etag}-{encoding}"'
+
+    def matches(self, if_none_match):
+        if if_none_match.strip() == '*':
+            return True
+        tags = {tag.strip() for tag in if_none_match.split(',')}
+        # If-None-Match uses the weak comparison
+        tags |= {tag[2:] for tag in tags if tag.startswith('W/')}
+        return any(self.etag_for(encoding) in tags for encoding in self.bodies)
+
+    def negotiate(self, accept_encoding):
+        accepted = {}
+        for entry in accept_encoding.split(','):
+            name, _, params = entry.strip().partition(';')
+            quality = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip().lower()] = quality
+        for encoding in ENCODINGS:
+            if encoding in self.bodies and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+        return 'identity'
+
+
+def load_variants(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    with open(path, 'rb') as f:
+        return ConfigVariants((stat.st_mtime_ns, stat.st_size), f.read())
+
+
+class ConfigCache:
+    # compressed configs of the most requested origins, an entry is replaced once the mtime or size of its file changes
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self.lock:
+                self.entries.pop(path, None)
+            return None
+        with self.lock:
+            variants = self.entries.get(path)
+            if variants is not None and variants.version == (stat.st_mtime_ns, stat.st_size):
+                self.entries.move_to_end(path)
+                return variants
+        # compressing happens outside of the lock, two requests for a new config may both do it
+        variants = load_variants(path)
+        if variants is not None:
+            with self.lock:
+                self.entries[path] = variants
+                self.entries.move_to_end(path)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        return variants
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
@@ -0,0 +1,403 @@
+import json
+import os
+import threading
+from base64 import b64decode
+from binascii import Error as Base64Error
+from collections import OrderedDict
+from hashlib import sha256
+from time import monotonic
+from urllib.parse import urljoin, urlsplit
+
+from esprima import error_handler
+
+from testapp.html_extract import extract_elements
+from testapp.js_regex import compile_js_regex, test_js_regex
+from testapp.script_normalize import strip_comments_and_whitespace
+
+# where config_generator writes the configs, one <host>_config.json per origin
+CONFIG_DIR = '/data/configs'
+# number of configs kept compiled in memory, least recently used ones are dropped
+CACHE_SIZE = 256
+# a config file is checked for changes at most once per interval
+RELOAD_INTERVAL = 1.0
+# default ports the URL origin leaves out, like URL.origin in the browser
+_DEFAULT_PORTS = {'http': 80, 'https': 443, 'ws': 80, 'wss': 443, 'ftp': 21}
+# marks the end of a prefix in _PrefixTrie, no character is the empty string
+_END = ''
+
+
+def _hash(value):
+    return sha256(value.encode()).hexdigest()
+
+
+def _is_json(value):
+    # JSON.parse doesn't know NaN and Infinity
+    def reject(constant):
+        raise ValueError(constant)
+
+    for candidate in (value, value[1:-1]):
+        try:
+            json.loads(candidate, parse_constant=reject)
+            return True
+        except (ValueError, RecursionError):
+            pass
+    return False
+
+
+def _url_origin(url):
+    port = url.port
+    netloc = url.hostname if port is None or port == _DEFAULT_PORTS.get(url.scheme) else f'{url.hostname}:{port}'
+    return f'{url.scheme}://{netloc}'
+
+
+def _decode_data_url(url):
+    # content of a data URL the way config_generator hashes it, None if it can't be decoded
+    separator_index = url.find(',')
+    prefix, data = url[:separator_index], url[separator_index + 1:]
+    try:
+        return b64decode(data).decode() if 'base64' in prefix else data
+    except (Base64Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def _has_script(elements):
+    return any(element.name == 'script' or any(key.startswith('on') and value for key, value in element.attrs.items())
+               for element in elements)
+
+
+class _PrefixTrie:
+    # character trie of allowlisted prefixes, a lookup walks the value once instead of calling startswith per prefix
+
+    __slots__ = ('root',)
+
+    def __init__(self, prefixes):
+        self.root = {}
+        for prefix in prefixes:
+            node = self.root
+            for c in prefix:
+                if _END in node:
+                    # a shorter prefix already allows everything below it
+                    break
+                node = node.setdefault(c, {})
+            else:
+                node.clear()
+                node[_END] = True
+
+    def __bool__(self):
+        return bool(self.root)
+
+    def match(self, value):
+        node = self.root
+        if _END in node:
+            return True
+        for c in value:
+            node = node.get(c)
+            if node is None:
+                return False
+            if _END in node:
+                return True
+        return False
+
+
+class _RegexSet:
+    # the regexes of an allowlist compiled once, inputs are normalized like regex_generator did before matching
+
+    __slots__ = ('patterns', 'untranslatable')
+
+    def __init__(self, regexes):
+        self.patterns, self.untranslatable = [], 0
+        for regex in dict.fromkeys(regexes):
+            pattern = compile_js_regex(regex)
+            # regexes outside of what regex_generator emits can't be checked without a JS engine, they never match
+            if pattern is None:
+                self.untranslatable += 1
+            else:
+                self.patterns.append(pattern)
+
+    def __bool__(self):
+        return bool(self.patterns) or self.untranslatable > 0
+
+    def match(self, value):
+        if not self.patterns:
+            return False
+        try:
+            value = strip_comments_and_whitespace(value)
+        except error_handler.Error:
+            return False
+        return any(test_js_regex(pattern, value) for pattern in self.patterns)
+
+
+class _TypePolicy:
+    # the policy of one party for one Trusted Type, sanitize returns the input if it is allowed unchanged, else None
+
+    MODES = ()
+
+    def __init__(self, policy, js_compatible=False):
+        # js_compatible accepts what library_node.js lets functionality_evaluator.js count as unchanged
+        self.js_compatible = js_compatible
+        self.allow_any = bool(policy.get('allow-any'))
+        self.modes = []
+        for mode in policy:
+            if mode in ('allow-any', 'strict'):
+                continue
+            # the enforcer rejects an input once it reaches a mode it doesn't know
+            if mode not in self.MODES:
+                self.modes.append(None)
+                break
+            self.modes.append(mode)
+
+    def sanitize(self, value, origin=None):
+        # empty inputs are always accepted
+        if not value or self.allow_any:
+            return value
+        return self._sanitize(value, origin)
+
+    def _sanitize(self, value, origin):
+        raise NotImplementedError
+
+
+class HtmlPolicy(_TypePolicy):
+
+    MODES = ('hashes', 'scripts')
+
+    def __init__(self, policy, js_compatible=False):
+        super().__init__(policy, js_compatible)
+        self.hashes = set(policy.get('hashes', []))
+        scripts = policy.get('scripts', {})
+        self.script_hashes = set(scripts.get('hashes', []))
+        self.script_prefixes = _PrefixTrie(scripts.get('prefixes', []))
+        self.script_regexes = _RegexSet(scripts.get('regexes', []))
+        self.strict = bool(policy.get('strict'))
+
+    def _snippet_allowed(self, snippet):
+        return _hash(snippet) in self.script_hashes or self.script_regexes.match(snippet)
+
+    def _element_allowed(self, element):
+        for key, value in element.attrs.items():
+            if key.startswith('on') and value and not self._snippet_allowed(value):
+                return False
+        if element.name == 'script':
+            src = element.get('src', '').strip()
+            if element.string:
+                return self._snippet_allowed(element.string) or bool(src) and self.script_prefixes.match(src)
+            # library_node.js lets every script without inline code pass, whatever its src
+            return self.js_compatible or not src or self.script_prefixes.match(src)
+        if element.name == 'iframe' and element.get('src', '').startswith('data:'):
+            # DOMPurify would strip any script from the embedded document
+            data = _decode_data_url(element['src'])
+            return data is not None and not _has_script(extract_elements(data))
+        return True
+
+    def _check_scripts(self, value):
+        elements = extract_elements(value)
+        if not self.script_hashes and not self.script_prefixes and not self.script_regexes:
+            # nothing is allowlisted, so no script may be used at all
+            # library_node.js returns the DOMPurify output, which the JS evaluator counts as unchanged
+            if self.js_compatible:
+                return None if self.strict else value
+            return None if self.strict or _has_script(elements) else value
+        # outside of strict mode the client library removes the violating parts, which still changes the input
+        return value if all(self._element_allowed(element) for element in elements) else None
+
+    def _sanitize(self, value, origin):
+        for mode in self.modes:
+            if mode == 'hashes':
+                if _hash(value) in self.hashes:
+                    return value
+            elif mode == 'scripts':
+                return self._check_scripts(value)
+            else:
+                return None
+        return None
+
+
+class ScriptPolicy(_TypePolicy):
+
+    MODES = ('hashes', 'regexes')
+
+    def __init__(self, policy, js_compatible=False):
+        super().__init__(policy, js_compatible)
+        self.hashes = set(policy.get('hashes', []))
+        self.regexes = _RegexSet(policy.get('regexes', []))
+
+    def _sanitize(self, value, origin):
+        # JSON can't be executed
+        if _is_json(value):
+            return value
+        for mode in self.modes:
+            if mode == 'hashes':
+                if _hash(value) in self.hashes:
+                    return value
+            elif mode == 'regexes':
+                if self.regexes.match(value):
+                    return value
+            else:
+                return None
+        return None
+
+
+class ScriptUrlPolicy(_TypePolicy):
+
+    MODES = ('hashes', 'origins', 'hosts', 'prefixes', 'eTLDs', 'dataHashes')
+
+    def __init__(self, policy, js_compatible=False):
+        super().__init__(policy, js_compatible)
+        self.hashes = set(policy.get('hashes', []))
+        self.origins = set(policy.get('origins', []))
+        self.hosts = set(policy.get('hosts', []))
+        self.prefixes = _PrefixTrie(policy.get('prefixes', []))
+        self.etlds = set(policy.get('eTLDs', []))
+        self.data_hashes = set(policy.get('dataHashes', []))
+
+    def _etld_allowed(self, host):
+        labels = (host or '').split('.')
+        # every eTLD+1 candidate from the shortest to the full host
+        return any('.'.join(labels[i:]) in self.etlds for i in range(len(labels) - 2, -1, -1))
+
+    def _sanitize(self, value, origin):
+        try:
+            url = urlsplit(urljoin(origin, value) if origin is not None else value)
+            # like new URL(), an invalid port makes the whole URL unparseable
+            url.port
+        except ValueError:
+            return None
+        for mode in self.modes:
+            if mode == 'hashes':
+                allowed = _hash(value) in self.hashes
+            elif mode == 'origins':
+                allowed = _url_origin(url) in self.origins
+            elif mode == 'hosts':
+                allowed = url.hostname in self.hosts
+            elif mode == 'prefixes':
+                allowed = self.prefixes.match(value)
+            elif mode == 'eTLDs':
+                allowed = self._etld_allowed(url.hostname)
+            elif mode == 'dataHashes':
+                if value.startswith('blob:'):
+                    # blob URLs are always followed by a http URL, which is checked like any other
+                    return value if self._sanitize(value[5:], origin) is not None else None
+                data = _decode_data_url(value) if value.startswith('data:') else None
+                allowed = data is not None and _hash(data) in self.data_hashes
+            else:
+                return None
+            if allowed:
+                return value
+        return None
+
+
+POLICY_TYPES = {'TrustedHTML': HtmlPolicy, 'TrustedScript': ScriptPolicy, 'TrustedScriptURL': ScriptUrlPolicy}
+
+
+class SiteConfig:
+    # a generated config, the policies of a party are compiled the first time one of its inputs is checked
+
+    def __init__(self, config, js_compatible=False):
+        self.ignore_list = config.pop('ignoreList', [])
+        self.config = config
+        self.js_compatible = js_compatible
+        self.parties = {}
+
+    def policy(self, party, trusted_type):
+        # json.dump writes a NULL party as "null"
+        party = 'null' if party is None else party
+        if party not in self.parties:
+            policies = self.config.get(party, {})
+            self.parties[party] = {name: POLICY_TYPES[name](policy, self.js_compatible)
+                                   for name, policy in policies.items() if name in POLICY_TYPES}
+        return self.parties[party].get(trusted_type)
+
+
+def config_name(origin):
+    # the file name config_generator uses for an origin
+    return origin if origin in (None, 'null') else urlsplit(origin).netloc
+
+
+class PolicyCache:
+    # compiled configs of the most recently used origins, a config is reloaded once its file changes
+
+    def __init__(self, directory=CONFIG_DIR, size=CACHE_SIZE, reload_interval=RELOAD_INTERVAL, js_compatible=False):
+        self.directory = directory
+        # only for functionality_evaluator.py, enforcement keeps the stricter checks
+        self.js_compatible = js_compatible
+        self.size = size
+        self.reload_interval = reload_interval
+        self.configs = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits, self.misses, self.reloads = 0, 0, 0
+
+    def path(self, origin):
+        return os.path.join(self.directory, f'{config_name(origin)}_config.json')
+
+    def _load(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with open(path) as f:
+            config = json.load(f)
+        return (stat.st_mtime_ns, stat.st_size), SiteConfig(config, self.js_compatible)
+
+    def get(self, origin):
+        path = self.path(origin)
+        with self.lock:
+            entry = self.configs.get(path)
+            if entry is not None:
+                version, config, checked = entry
+                if monotonic() - checked < self.reload_interval:
+                    self.configs.move_to_end(path)
+                    self.hits += 1
+                    return config
+                try:
+                    stat = os.stat(path)
+                    current = stat.st_mtime_ns, stat.st_size
+                except OSError:
+                    current = None
+                if current == version:
+                    self.configs[path] = version, config, monotonic()
+                    self.configs.move_to_end(path)
+                    self.hits += 1
+                    return config
+                self.reloads += 1
+                del self.configs[path]
+            else:
+                self.misses += 1
+            loaded = self._load(path)
+            if loaded is None:
+                return None
+            version, config = loaded
+            self.configs[path] = version, config, monotonic()
+            while len(self.configs) > self.size:
+                self.configs.popitem(last=False)
+            return config
+
+    def policy(self, origin, party, trusted_type):
+        config = self.get(origin)
+        return config.policy(party, trusted_type) if config is not None else None
+
+    def sanitize(self, origin, party, trusted_type, value):
+        # None for rejected inputs, also if the origin has no config or the party no policy for the type
+        policy = self.policy(origin, party, trusted_type)
+        return policy.sanitize(value, origin) if policy is not None else None
+
+
+# one cache per process and directory
+_caches = {}
+
+
+def load_policy_cache(directory=CONFIG_DIR):
+    key = (os.getpid(), os.path.abspath(directory))
+    if key not in _caches:
+        _caches[key] = PolicyCache(directory)
+    return _caches[key]
+
+
+def sanitize_html(origin, party, value, directory=CONFIG_DIR):
+    return load_policy_cache(directory).sanitize(origin, party, 'TrustedHTML', value)
+
+
+def sanitize_script(origin, party, value, directory=CONFIG_DIR):
+    return load_policy_cache(directory).sanitize(origin, party, 'TrustedScript', value)
+
+
+def sanitize_script_url(origin, party, value, directory=CONFIG_DIR):
+    return load_policy_cache(directory).sanitize(origin, party, 'TrustedScriptURL', value)
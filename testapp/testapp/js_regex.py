@@ -0,0 +1,82 @@
+# a copy of scripts/generators/js_regex.py, so the testapp doesn't depend on the layout of the research scripts
+# both have to stay the same, the enforcement must parse inputs exactly like the generators did
+import re
+
+# Python equivalents of the character classes get_regex_for_tuple emits, a JS '.' doesn't match any line terminator
+_CLASSES = {
+    r'[a-zA-Z0-9\"_;-]': r'[a-zA-Z0-9\"_;-]',
+    r'[a-zA-Z0-9]': r'[a-zA-Z0-9]',
+    r'[a-z0-9]': r'[a-z0-9]',
+    r'[a-z]': r'[a-z]',
+    r'.': '[^\n\r\u2028\u2029]',
+}
+_QUANTIFIER = re.compile(r'\{\d+(,\d+)?\}')
+_SPECIAL = set('^$\\.|?*+()[]{}')
+_ASTRAL = re.compile('[\U00010000-\U0010ffff]')
+
+
+def _to_code_units(value):
+    # JS regexes without the u flag work on UTF-16 code units, so split astral characters into surrogate pairs
+    if _ASTRAL.search(value) is None:
+        return value
+    data = value.encode('utf-16-le', 'surrogatepass')
+    return ''.join(chr(int.from_bytes(data[i:i + 2], 'little')) for i in range(0, len(data), 2))
+
+
+def translate_js_regex(regex):
+    # translates the subset of JS regex syntax used by regex_generator, None for anything outside of it
+    parts, i, n = [], 0, len(regex)
+    if regex.startswith('^'):
+        parts.append(r'\A')
+        i = 1
+    while i < n:
+        c = regex[i]
+        if c == '\\':
+            # escaped punctuation is a literal in both dialects, escaped letters and digits are not
+            if i + 1 == n or regex[i + 1].isalnum():
+                return None
+            parts.append(regex[i:i + 2])
+            i += 2
+            continue
+        if c == '$' and i == n - 1:
+            parts.append(r'\Z')
+            break
+        # non-capturing groups and alternatives of the regexes merged by merge_regexes.py
+        if regex.startswith('(?:', i):
+            parts.append('(?:')
+            i += 3
+            continue
+        if c == '|':
+            parts.append('|')
+            i += 1
+            continue
+        if c == ')':
+            optional = regex.startswith('?', i + 1)
+            parts.append(')?' if optional else ')')
+            i += 2 if optional else 1
+            continue
+        for js_class, py_class in _CLASSES.items():
+            if regex.startswith(js_class, i):
+                parts.append(py_class)
+                i += len(js_class)
+                quantifier = _QUANTIFIER.match(regex, i)
+                if quantifier is not None:
+                    parts.append(quantifier.group())
+                    i = quantifier.end()
+                break
+        else:
+            if c in _SPECIAL:
+                return None
+            parts.append(re.escape(_to_code_units(c)))
+            i += 1
+    return ''.join(parts)
+
+
+def compile_js_regex(regex):
+    pattern = translate_js_regex(regex)
+    return re.compile(pattern) if pattern is not None else None
+
+
+def test_js_regex(pattern, value):
+    # same result as new RegExp(regex).test(value) for a pattern returned by compile_js_regex
+    return pattern.search(_to_code_units(value)) is not None
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/3.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
+import os
 from os.path import join
 from pathlib import Path
 
@@ -119,3 +120,13 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 STATICFILES_DIRS = [BASE_DIR / 'testapp/static/']
+
+
+# Generated configs served per origin under /configs/<host>.json
+
+CONFIG_DIR = os.environ.get('TT_CONFIG_DIR', '/data/configs')
+
+# number of configs kept compressed in memory, 0 reads and compresses the file on every request
+CONFIG_CACHE_SIZE = int(os.environ.get('TT_CONFIG_CACHE_SIZE', 1024))
+# clients revalidate a config with its ETag once it is older than this
+CONFIG_MAX_AGE = 24 * 60 * 60
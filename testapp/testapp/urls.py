@@ -20,5 +20,6 @@ from testapp import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('', views.test)
+    path('', views.test),
+    path('configs/<str:host>.json', views.config)
 ]
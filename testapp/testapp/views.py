@@ -1,7 +1,35 @@
+import os
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotModified
 from django.shortcuts import render
+from django.views.decorators.http import require_safe
+
+from testapp.configs import ConfigCache
+
+config_cache = ConfigCache(settings.CONFIG_CACHE_SIZE)
 
 
 def test(request):
     response = render(request, 'test.html')
     response['Content-Security-Policy'] = "require-trusted-types-for 'script';"
     return response
+
+
+@require_safe
+def config(request, host):
+    # host is a single path segment, so it can't leave CONFIG_DIR
+    variants = config_cache.get(os.path.join(settings.CONFIG_DIR, f'{host}_config.json'))
+    if variants is None:
+        raise Http404(f'No config for {host}')
+    encoding = variants.negotiate(request.headers.get('Accept-Encoding', ''))
+    if 'If-None-Match' in request.headers and variants.matches(request.headers['If-None-Match']):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(variants.bodies[encoding], content_type='application/json')
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+    response['ETag'] = variants.etag_for(encoding)
+    response['Cache-Control'] = f'public, max-age={settings.CONFIG_MAX_AGE}'
+    response['Vary'] = 'Accept-Encoding'
+    return response